@@ -0,0 +1,304 @@
+"""\
+Headless benchmark of the frame pipeline
+
+Builds a synthetic rig, drives the real SceneController with generated Synesthesia OSC data on a simulated clock,
+and times each stage of every frame.  Results can be saved as a baseline and later runs checked against it.
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import time
+
+from lib import HasThread
+
+# Nothing here should run in the background (e.g. the metrics reporter printing over the report) - this must be set
+# before the other lib imports create their components
+HasThread.autostart = False
+
+from lib.data import Transition, Effect, Program, Scene, SceneController, CircleMovementTransition, Trigger
+from lib.frame import FrameScheduler, SimulatedClock, set_clock
+from lib.inputs import Input
+from lib.inputs.osc.flavors import SynesthesiaOSCFlavor
+from lib.inputs.recording import ReplayInput
+from lib.lights import DMXLightType, DMXLightTypeFunction, DMXLight
+from lib.outputs.dmx import DMXDevice, UNIVERSE_SIZE
+
+
+STAGES = ('input', 'triggers', 'effects', 'update_state', 'dmx_pack')
+
+
+def build_light_types():
+    moving = DMXLightType('BenchMovingHead', 18, [
+        DMXLightTypeFunction('pan', None, map_highres=('pan_coarse', 'pan_fine'), range_deg=540),
+        DMXLightTypeFunction('pan_coarse', 1),
+        DMXLightTypeFunction('pan_fine', 2),
+        DMXLightTypeFunction('tilt', None, map_highres=('tilt_coarse', 'tilt_fine'), range_deg=220),
+        DMXLightTypeFunction('tilt_coarse', 3),
+        DMXLightTypeFunction('tilt_fine', 4),
+        DMXLightTypeFunction('speed', 5, invert=True),
+        DMXLightTypeFunction('dim', 6),
+        DMXLightTypeFunction('strobe', 7),
+        DMXLightTypeFunction('rgb', None, map_multi=('red', 'green', 'blue')),
+        DMXLightTypeFunction('red', 8),
+        DMXLightTypeFunction('green', 9),
+        DMXLightTypeFunction('blue', 10),
+        DMXLightTypeFunction('white', 11),
+        DMXLightTypeFunction('amber', 12),
+        DMXLightTypeFunction('uv', 13),
+        DMXLightTypeFunction('mode', 14, mapping={'manual': [0, 127], 'auto': [128, 255]}),
+        DMXLightTypeFunction('gobo', 15, mapping={'gobo_{}'.format(i): [i * 16, (i * 16) + 15] for i in range(16)}),
+    ])
+    par = DMXLightType('BenchPar', 8, [
+        DMXLightTypeFunction('dim', 1),
+        DMXLightTypeFunction('rgb', None, map_multi=('red', 'green', 'blue')),
+        DMXLightTypeFunction('red', 2),
+        DMXLightTypeFunction('green', 3),
+        DMXLightTypeFunction('blue', 4),
+        DMXLightTypeFunction('white', 5),
+        DMXLightTypeFunction('strobe_mode', 6, mapping={
+            'par_strobe': [0, 99],
+            'par': [100, 199],
+            'strobe': [200, 255],
+        }),
+        DMXLightTypeFunction('strobe', 7),
+        DMXLightTypeFunction('mode', 8, mapping={
+            'manual': [0, 50],
+            'jump': [51, 100],
+            'gradual': [101, 150],
+            'pulse': [151, 200],
+            'auto': [201, 250],
+            'sound': [251, 255],
+        }),
+    ])
+    return [moving, par]
+
+
+def build_rig(num_lights, num_universes):
+    # Alternates moving heads and pars, filling universes evenly; returns a list of (light, universe index)
+    types = build_light_types()
+    per_universe = math.ceil(num_lights / num_universes)
+    rig = []
+    for u in range(num_universes):
+        channel = 1
+        for i in range(per_universe):
+            index = (u * per_universe) + i
+            if index >= num_lights:
+                break
+            light_type = types[index % len(types)]
+            if channel + light_type.channels - 1 > UNIVERSE_SIZE:
+                raise ValueError(f"Too many lights for {num_universes} universe(s)")
+            groups = ['moving' if light_type is types[0] else 'par', 'odd' if index % 2 else 'even']
+            rig.append((DMXLight(f'bench_{index}', channel, light_type, groups=groups), u))
+            channel += light_type.channels
+    return rig
+
+
+def build_controller():
+    return SceneController([
+        Scene('bench', [
+            Program('base', [
+                Effect('base', [
+                    Transition('dim', 30, start_value=1, end_value=1),
+                    Transition('speed', 30, start_value=1, end_value=1),
+                ]),
+            ], multiple=True, multiple_all=True),
+            Program('move', [
+                Effect('circles', [
+                    CircleMovementTransition(270, 110, 40, 2, duration_beat=4, spread={'pan': -20}),
+                ]),
+                Effect('gobos', [
+                    Transition('gobo', 2, start_value='RANDOM', end_value='START', duration_beat=4),
+                ]),
+            ], groups=['moving'], trigger_next=[Trigger('audio/beat/onbeat', 0.9, cooldown=4, cooldown_beat=8)]),
+            Program('color', [
+                Effect('fade', [
+                    Transition('rgb', 1, start_value='CURRENT', end_value='RANDOMRGB', duration_beat=2),
+                    Transition('white', 1, start_value=0, end_value=0.5, easing='QuadEaseInOut', duration_beat=2, spread={'delay': 0.01}),
+                ]),
+            ], multiple=True, multiple_all=True),
+            Program('hits', [
+                Effect('flash', [
+                    Transition('dim', 0.25, start_value=1, end_value=0, easing='ExponentialEaseOut'),
+                ], groups=['odd'], trigger_run=[Trigger('audio/hits/bass', 0.9, cooldown=0.25, cooldown_beat=0.5)]),
+                Effect('flash_even', [
+                    Transition('dim', 0.25, start_value=1, end_value=0, easing='ExponentialEaseOut'),
+                ], groups=['even'], trigger_run=[Trigger('audio/hits/mid', 0.9)]),
+                Effect('dark', [
+                    Transition('dim', 0.5, start_value='CURRENT', end_value=0),
+                ], trigger_run=[Trigger('audio/level/all', 0.05, below_threshold=True)]),
+            ], multiple=True),
+        ]),
+    ])
+
+
+class OSCGenerator:
+    """\
+    Generates plausible Synesthesia values for every address in the flavor, at a fixed BPM
+    """
+
+    def __init__(self, flavor, bpm=128.0, seed=0):
+        self.flavor = flavor
+        self.bpm = bpm
+        self.random = random.Random(seed)
+        self.addresses = [a.address for a in flavor.EVENTS]
+
+    def _value(self, address, t):
+        beat = t * self.bpm / 60.0
+        phase = beat % 1
+        if address == '/audio/bpm/bpm':
+            return self.bpm
+        if address == '/audio/bpm/bpmconfidence':
+            return 0.9
+        if address == '/audio/beat/beattime':
+            return float(int(beat))
+        if address == '/audio/beat/onbeat':
+            return 1.0 if phase < 0.1 else 0.0
+        if address.startswith('/audio/hits/'):
+            return 1.0 if self.random.random() < 0.03 else 0.0
+        if address.startswith('/audio/bpm/'):
+            return (math.sin(phase * 2 * math.pi) + 1) / 2
+        if address.startswith('/audio/time/'):
+            return t
+        # Levels, presence and energy - a slow swell with noise, occasionally dropping out
+        swell = (math.sin(t / 8.0) + 1) / 2
+        return max(0.0, min(1.0, swell + self.random.uniform(-0.1, 0.1)))
+
+    def __call__(self, t):
+        # One message per address, the way the OSC server thread would
+        for address in self.addresses:
+            event, args = self.flavor(address, self._value(address, t))
+            if len(args) == 1:
+                args = args[0]
+            Input.ingest(event, args)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def run(args):
+    clock = SimulatedClock(start=1000.0)
+    set_clock(clock)
+    scheduler = FrameScheduler(fps=args.fps, clock=clock)
+
+    rig = build_rig(args.lights, args.universes)
+    lights = [l for l, _ in rig]
+    devices = [DMXDevice(debug=False) for _ in range(args.universes)]
+    controller = build_controller()
+    if args.replay:
+        # Frame-exact: each frame gets the events recorded up to its (simulated) time
+        replay = ReplayInput(args.replay, clock=clock, start_immediately=False)
+        generator = replay.feed_until
+    else:
+        replay = None
+        generator = OSCGenerator(SynesthesiaOSCFlavor(), seed=args.seed)
+
+    timings = {s: [] for s in STAGES}
+    data_version = None
+    totals = []
+    timer = time.perf_counter
+    for i in range(args.warmup + args.frames):
+        frame = scheduler.wait()
+        generator(frame.time)
+        if replay and replay.finished:
+            break
+
+        t0 = timer()
+        Input.process_events()
+        data = Input.get_data(process=False)
+        changed = Input.changed_since(data_version)
+        data_version = data.version
+        t1 = timer()
+        controller.run_triggers(data, frame=frame, changed=changed)
+        t2 = timer()
+        output = controller(data, lights, frame=frame)
+        t3 = timer()
+        modified = []
+        for light, u in rig:
+            if light.name in output:
+                light.update_state(output[light.name])
+                modified.append((light, u))
+        t4 = timer()
+        for light, u in modified:
+            devices[u].set_block(light.channel, light.get_dmx_block())
+        t5 = timer()
+
+        if i >= args.warmup:
+            for stage, elapsed in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+                timings[stage].append(elapsed)
+            totals.append(t5 - t0)
+
+    results = {'stages': {}}
+    for stage in STAGES + ('total',):
+        values = sorted(totals if stage == 'total' else timings[stage])
+        results['stages'][stage] = {'p50': percentile(values, 0.5), 'p99': percentile(values, 0.99)}
+    results['fps'] = len(totals) / sum(totals) if sum(totals) else 0.0
+    results['config'] = {'lights': args.lights, 'universes': args.universes, 'frames': args.frames, 'fps': args.fps, 'replay': args.replay}
+    return results
+
+
+def report(results):
+    print("{:<14} {:>10} {:>10}".format('stage', 'p50 ms', 'p99 ms'))
+    for stage, r in results['stages'].items():
+        print("{:<14} {:>10.3f} {:>10.3f}".format(stage, r['p50'] * 1000, r['p99'] * 1000))
+    print("Max sustainable FPS: {:.1f}".format(results['fps']))
+
+
+def check_baseline(results, baseline, tolerance):
+    # Returns a list of regression descriptions, empty if everything is within tolerance
+    if baseline.get('config') != results['config']:
+        print("Warning: baseline was recorded with a different configuration:", baseline.get('config'), file=sys.stderr)
+
+    regressions = []
+    for stage, r in results['stages'].items():
+        base = baseline['stages'].get(stage)
+        if not base:
+            continue
+        for key in ('p50', 'p99'):
+            if base[key] and r[key] > base[key] * (1 + tolerance):
+                regressions.append("{} {}: {:.3f}ms (baseline {:.3f}ms)".format(stage, key, r[key] * 1000, base[key] * 1000))
+    if baseline.get('fps') and results['fps'] < baseline['fps'] / (1 + tolerance):
+        regressions.append("fps: {:.1f} (baseline {:.1f})".format(results['fps'], baseline['fps']))
+    return regressions
+
+
+parser = argparse.ArgumentParser(description='Partylights frame pipeline benchmark')
+parser.add_argument('--lights', type=int, default=200, help='Number of lights in the rig (default: %(default)s)')
+parser.add_argument('--universes', type=int, default=8, help='Number of DMX universes to spread them over (default: %(default)s)')
+parser.add_argument('--frames', type=int, default=2000, help='Number of frames to time (default: %(default)s)')
+parser.add_argument('--warmup', type=int, default=100, help='Number of untimed frames to run first (default: %(default)s)')
+parser.add_argument('--fps', type=float, default=70.0, help='Simulated frame rate (default: %(default)s)')
+parser.add_argument('--replay', metavar='FILE', help='Drive the pipeline with an input recording instead of generated data')
+parser.add_argument('--seed', type=int, default=0, help='Seed for the generated input data (default: %(default)s)')
+parser.add_argument('--baseline', help='Compare against this baseline file, exiting with status 1 on a regression')
+parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown relative to the baseline (default: %(default)s)')
+parser.add_argument('--save-baseline', help='Write the results to this file')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    try:
+        results = run(args)
+    finally:
+        HasThread.stop_all()
+
+    report(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as fp:
+            regressions = check_baseline(results, json.load(fp), args.tolerance)
+        if regressions:
+            print("Regressions:", *regressions, sep='\n  ')
+            sys.exit(1)
+        print("No regressions against", args.baseline)
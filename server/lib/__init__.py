@@ -4,8 +4,10 @@ import time
 
 class HasThread:
     all_threads = []
+    # Default for start_immediately - cleared when something else (e.g. the asyncio runtime) drives the components
+    autostart = True
 
-    def __init__(self, *args, target_name='run_thread_loop', start_immediately=True, **kwargs):
+    def __init__(self, *args, target_name='run_thread_loop', start_immediately=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.stop_thread = threading.Event()
         self.thread = None
@@ -16,7 +18,7 @@ class HasThread:
 
         self.thread = threading.Thread(target=self.run_thread)
         self.all_threads.append(self)
-        if start_immediately:
+        if self.autostart if start_immediately is None else start_immediately:
             self.start()
 
     def setup_main(self):
@@ -42,7 +44,8 @@ class HasThread:
             self.join()
 
     def join(self):
-        if self.thread:
+        # Threads that were never started have nothing to join
+        if self.thread and self.thread.ident is not None:
             self.thread.join()
             self.teardown_main()
 
@@ -0,0 +1,125 @@
+"""\
+asyncio runtime - runs OSC input, the frame loop and outputs on one event loop instead of a thread each
+
+Components must be created with HasThread.autostart cleared so they don't also start their own threads.  Outputs
+keep their Mailbox/Queue, the event loop just wakes them after each frame; process_lights runs in a single worker
+executor per output so blocking serial writes don't stall the loop.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+
+from lib import metrics
+from lib.inputs import Input
+from lib.inputs.osc.udp import OSCDecoder, map_messages
+from lib.outputs import Output
+
+
+class OSCDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, osc_flavor):
+        self.osc_flavor = osc_flavor
+        self.decoder = OSCDecoder(osc_flavor)
+
+    def datagram_received(self, data, addr):
+        # This runs on the event loop, so a bad datagram is dropped rather than allowed to take the loop down
+        try:
+            events = map_messages(self.osc_flavor, self.decoder.decode(data))
+        except Exception as e:
+            metrics.count('osc.errors')
+            print("Dropped OSC datagram from {}: {!r}".format(addr, e))
+            return
+        if events:
+            Input.ingest_many(events)
+
+
+class AsyncRuntime:
+    def __init__(self, run_frame, scheduler, osc_flavor=None, host='0.0.0.0', port=7000):
+        """\
+        Args:
+        run_frame: Called with each Frame from the scheduler, runs one frame of the pipeline
+        scheduler: A FrameScheduler for pacing frames
+        osc_flavor: OSC flavor to receive with, None for no OSC input
+        host, port: Where to listen for OSC
+        """
+
+        self.run_frame = run_frame
+        self.scheduler = scheduler
+        self.osc_flavor = osc_flavor
+        self.host = host
+        self.port = port
+        self.stop_event = None
+        self.wakeups = {}
+        self.executors = {}
+
+    def stop(self):
+        if self.stop_event:
+            self.stop_event.set()
+
+    async def frame_loop(self):
+        while not self.stop_event.is_set():
+            delay = self.scheduler.next_delay()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.stop_event.wait(), delay)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+            self.run_frame(self.scheduler.tick())
+            for wakeup in self.wakeups.values():
+                wakeup.set()
+
+    async def output_loop(self, output):
+        loop = asyncio.get_running_loop()
+        wakeup = self.wakeups[output]
+        while True:
+            try:
+                await asyncio.wait_for(wakeup.wait(), output.idle_interval)
+            except asyncio.TimeoutError:
+                await loop.run_in_executor(self.executors[output], output.idle)
+                continue
+            wakeup.clear()
+            # A lossless queue may hold several frames, a mailbox at most one
+            while True:
+                try:
+                    lights = output.queue.get(timeout=0)
+                except Empty:
+                    break
+                await loop.run_in_executor(self.executors[output], output.process_lights, lights)
+
+    async def metrics_loop(self):
+        while True:
+            await asyncio.sleep(1)
+            metrics.report()
+
+    async def main(self, signals=()):
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        for signo in signals:
+            loop.add_signal_handler(signo, self.stop)
+
+        transport = None
+        if self.osc_flavor is not None:
+            transport, _ = await loop.create_datagram_endpoint(lambda: OSCDatagramProtocol(self.osc_flavor), local_addr=(self.host, self.port))
+
+        tasks = [asyncio.create_task(self.metrics_loop())]
+        for output in Output.all_outputs:
+            self.wakeups[output] = asyncio.Event()
+            self.executors[output] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'output-{output.name}')
+            tasks.append(asyncio.create_task(self.output_loop(output)))
+
+        try:
+            await self.frame_loop()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if transport:
+                transport.close()
+            # Closed in their executors, after any process_lights still running there
+            for output, executor in self.executors.items():
+                await loop.run_in_executor(executor, output.close)
+                executor.shutdown(wait=True)
+
+    def run(self, signals=()):
+        asyncio.run(self.main(signals=signals))
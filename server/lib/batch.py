@@ -0,0 +1,101 @@
+"""\
+Batched evaluation of the transitions in a running Effect
+
+Requires numpy, which is optional - when it is not installed, effects are evaluated one transition at a time
+"""
+
+from . import easing
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def available():
+    return np is not None
+
+
+class BatchEvaluator:
+    """\
+    Evaluates all plain scalar transitions of an effect in a few array operations
+
+    Transitions that can't be batched (movements, colors, mapped values, zero durations) are evaluated individually
+    in place, so the output is the same list of values the scalar path would produce, in the same order.
+    """
+
+    # Below this many batchable transitions the array setup costs more than it saves
+    MIN_SIZE = 16
+
+    def __init__(self, transitions):
+        self.transitions = list(transitions)
+        self.slots = []
+        self.others = []
+        for i, t in enumerate(self.transitions):
+            if self.can_batch(t):
+                self.slots.append(i)
+            else:
+                self.others.append(i)
+
+        batched = [self.transitions[i] for i in self.slots]
+        self.end_values = [t.end_value for t in batched]
+        self.start = np.array([t.start_value for t in batched], dtype=float)
+        self.end = np.array(self.end_values, dtype=float)
+        self.begin = np.array([t.started_at + t.delay for t in batched], dtype=float)
+        self.duration = np.array([t.duration for t in batched], dtype=float)
+        self.started_at = np.array([t.started_at for t in batched], dtype=float)
+        self.span = np.array([t.delay + t.duration for t in batched], dtype=float)
+
+        # Group by easing so each easing table is applied once per frame
+        easings = {}
+        for k, t in enumerate(batched):
+            easings.setdefault(t.easing_id, []).append(k)
+        self.easings = [(e, np.array(idx)) for e, idx in easings.items()]
+
+    @staticmethod
+    def can_batch(t):
+        from .data import Transition
+
+        # Only the base Transition with numeric endpoints - subclasses compute something other than a lerp
+        if type(t) is not Transition or not hasattr(t, 'started_at'):
+            return False
+        for v in (t.start_value, t.end_value):
+            if isinstance(v, bool) or not isinstance(v, (int, float)):
+                return False
+        return t.duration > 0
+
+    @classmethod
+    def for_transitions(cls, transitions):
+        # Returns an evaluator, or None when batching is unavailable or not worthwhile
+        if np is None:
+            return None
+        if sum(1 for t in transitions if cls.can_batch(t)) < cls.MIN_SIZE:
+            return None
+        return cls(transitions)
+
+    def _ease(self, percent):
+        clipped = np.clip(percent, 0.0, 1.0)
+        mul = np.empty_like(clipped)
+        for easing_id, idx in self.easings:
+            mul[idx] = easing.get_table(easing_id).evaluate_many(clipped[idx])
+        return mul
+
+    def is_running_at(self, now):
+        if self.slots and bool(np.any(now - self.started_at <= self.span)):
+            return True
+        return any((self.transitions[i].is_running_at(now) for i in self.others))
+
+    def __call__(self, data, now, frame=None):
+        values = [None] * len(self.transitions)
+        for i in self.others:
+            values[i] = self.transitions[i](data, frame)
+
+        if self.slots:
+            percent = (now - self.begin) / self.duration
+            lerp = self.start + ((self.end - self.start) * self._ease(percent))
+            for i, end, p, v in zip(self.slots, self.end_values, percent.tolist(), lerp.tolist()):
+                if p <= 0:
+                    continue
+                values[i] = end if p >= 1 else v
+
+        return values
@@ -1,11 +1,14 @@
-import time
 import colorsys
+import functools
+import heapq
 import math
 import random
 
-import easing_functions
-
 from . import Named, ListOf
+from . import easing as easing_tables
+from .batch import BatchEvaluator
+from .frame import Frame, frame_time
+from .inputs import events
 
 
 RGB_COLORS = {
@@ -22,9 +25,13 @@ RGB_COLORS = {
 }
 
 
+BPM_EVENT = events.intern('audio/bpm/bpm')
+BPM_CONFIDENCE_EVENT = events.intern('audio/bpm/bpmconfidence')
+
+
 def get_bpm_duration(data, beats):
-    conf = data.get('audio/bpm/bpmconfidence')
-    bpm = data.get('audio/bpm/bpm')
+    conf = data.get(BPM_CONFIDENCE_EVENT)
+    bpm = data.get(BPM_EVENT)
     if conf and bpm:
         conf = conf[0]
         bpm = bpm[0]
@@ -34,6 +41,48 @@ def get_bpm_duration(data, beats):
     return None
 
 
+HISTORY_STATS = ('mean', 'min', 'max', 'ema')
+
+
+def get_history_value(data, event, stat, window=None, window_beat=None, now=None):
+    """\
+    A windowed value of an event (ID or name) from its EventHistory, or None if there is no history for it
+
+    The window is in seconds, or beats if window_beat is given and the BPM is known; None covers the whole history.
+    It ends at now (the current frame time by default), so it keeps sliding when the event stops updating.
+    """
+
+    history = data.history(event) if hasattr(data, 'history') else None
+    if history is None:
+        return None
+    if window_beat:
+        window = get_bpm_duration(data, window_beat) or window
+    return history.get(stat, window, frame_time() if now is None else now)
+
+
+@functools.lru_cache(maxsize=None)
+def parse_event_ref(value):
+    """\
+    Parse an @event transition value as (event ID, stat, window, window_beat)
+
+    @audio/level/bass is the current value, @audio/level/bass:mean the mean of its history, @audio/level/bass:max:2
+    the max over the last 2 seconds and @audio/level/bass:mean:2b the mean over the last 2 beats.
+    """
+
+    event, _, rest = value[1:].partition(':')
+    event = events.intern(event)
+    if not rest:
+        return event, None, None, None
+    stat, _, window = rest.partition(':')
+    if stat not in HISTORY_STATS:
+        raise ValueError(f"Unknown history stat in {value}: {stat}")
+    if not window:
+        return event, stat, None, None
+    if window.endswith('b'):
+        return event, stat, None, float(window[:-1])
+    return event, stat, float(window), None
+
+
 def is_iterable(val):
     try:
         iter(val)
@@ -46,11 +95,23 @@ def HasTriggers(*names):
     class HasTriggersImpl:
         def __init__(self, *args, **kwargs):
             self.triggers = {n: kwargs.pop('trigger_' + n, None) or [] for n in names}
+            # Number of times each trigger group fired, counted when it goes from false to true - a group held true
+            # for several frames fires once
+            self.trigger_counts = {n: 0 for n in names}
+            self.trigger_active = {n: False for n in names}
+            self.trigger_index = None
             super().__init__(*args, **kwargs)
 
-        def run_triggers(self, data):
+        def run_triggers(self, data, frame=None):
             for name, triggers in self.triggers.items():
-                if Trigger.run_trigger_group(data, triggers):
+                if self.trigger_index is not None:
+                    fired = self.trigger_index.group_result(triggers)
+                else:
+                    fired = Trigger.run_trigger_group(data, triggers, frame=frame)
+                if fired and not self.trigger_active[name]:
+                    self.trigger_counts[name] += 1
+                self.trigger_active[name] = bool(fired)
+                if fired:
                     yield name
 
     return HasTriggersImpl
@@ -81,7 +142,7 @@ class HasLightFilter:
 class Transition(HasLightFilter, Dummy):
     cycle_direction = {}
 
-    def __init__(self, property, duration, delay=None, start_value=None, end_value=None, duration_beat=None, delay_beat=None, easing='LinearInOut', spread=None, light=None, keep=None, **kwargs):
+    def __init__(self, property, duration, delay=None, start_value=None, end_value=None, duration_beat=None, delay_beat=None, easing='LinearInOut', spread=None, light=None, keep=None, started_at=None, **kwargs):
         super().__init__(**kwargs)
         self.property = property
         self.duration = duration
@@ -100,11 +161,16 @@ class Transition(HasLightFilter, Dummy):
         self.light = light
         self.keep = keep
 
+        # Intern (and check) @event references now rather than on the first copy
+        for value in (start_value, end_value):
+            if isinstance(value, str) and value.startswith('@'):
+                parse_event_ref(value)
+
         if self.light:
-            self.started_at = time.time()
-            self.easing_function = getattr(easing_functions, self.easing, easing_functions.LinearInOut)(start=0.0, end=1.0, duration=1.0)
+            self.started_at = frame_time() if started_at is None else started_at
+            self.easing_id = easing_tables.get_id(self.easing)
 
-    def _prep_to_copy(self, index, light, data):
+    def _prep_to_copy(self, index, light, data, now=None):
         if self.light:
             raise RuntimeError("Can't copy to a light, already assigned")
 
@@ -177,13 +243,17 @@ class Transition(HasLightFilter, Dummy):
                 # return [random.random() for _ in range(3)]
                 return random.choice(list(RGB_COLORS.values()))
             elif str(value).startswith('@'):
-                value = data.get(value[1:], 0)
-                try:
-                    iter(value)
-                except:
-                    pass
+                event, stat, window, window_beat = parse_event_ref(value)
+                if stat:
+                    value = get_history_value(data, event, stat, window, window_beat, now) or 0
                 else:
-                    value = value[0]
+                    value = data.get(event, 0)
+                    try:
+                        iter(value)
+                    except:
+                        pass
+                    else:
+                        value = value[0]
                 return min(1, max(0, value))
             else:
                 try:
@@ -221,23 +291,27 @@ class Transition(HasLightFilter, Dummy):
     def _copy(self, *args, **kwargs):
         return Transition(*args, **kwargs)
 
-    def for_lights(self, lights, data):
+    def for_lights(self, lights, data, frame=None):
         lights = self._filter_lights(lights)
+        started_at = frame_time(frame)
         last_kwargs = None
         for index, light in enumerate(lights):
-            kwargs = self._prep_to_copy(index, light, data)
+            kwargs = self._prep_to_copy(index, light, data, started_at)
             kwargs = self._apply_spread(index, light, data, kwargs)
             if self.keep and last_kwargs:
                 kwargs.update({k: last_kwargs.get(k, kwargs.get(k, 0)) for k in self.keep})
-            yield self._copy(**kwargs)
+            yield self._copy(started_at=started_at, **kwargs)
             last_kwargs = kwargs
 
+    def is_running_at(self, now):
+        return hasattr(self, 'started_at') and now - self.started_at <= self.delay + self.duration
+
     @property
     def is_running(self):
-        return hasattr(self, 'started_at') and time.time() - self.started_at <= self.delay + self.duration
+        return self.is_running_at(frame_time())
 
-    def _calc_percent(self, data):
-        return (time.time() - (self.started_at + self.delay)) / self.duration
+    def _calc_percent(self, data, frame=None):
+        return (frame_time(frame) - (self.started_at + self.delay)) / self.duration
 
     def _calc_short_circuit(self, data, percent):
         if percent <= 0:
@@ -248,13 +322,13 @@ class Transition(HasLightFilter, Dummy):
         return True
 
     def _calc_easing(self, data, percent):
-        mul = self.easing_function(percent)
+        mul = easing_tables.evaluate(self.easing_id, percent)
         # TODO: scaling - where does this go & how does it work?
         conv = lambda s, e: s + ((e - s) * mul)
         return mul, conv
 
-    def __call__(self, data):
-        percent = self._calc_percent(data)
+    def __call__(self, data, frame=None):
+        percent = self._calc_percent(data, frame)
         res = self._calc_short_circuit(data, percent)
         if res is not True:
             return res
@@ -287,8 +361,8 @@ class MovementTransition(Transition):
         # Pass some default values to satisfy the parent constructor, they won't really be used
         super().__init__('pan', duration, delay=delay, start_value=0, end_value=1, duration_beat=duration_beat, delay_beat=delay_beat, easing=easing, spread=spread, light=light, **kwargs)
 
-    def _prep_to_copy(self, index, light, data):
-        kwargs = super()._prep_to_copy(index, light, data)
+    def _prep_to_copy(self, index, light, data, now=None):
+        kwargs = super()._prep_to_copy(index, light, data, now)
         for k in ('property', 'start_value', 'end_value'):
             kwargs.pop(k, None)
         return kwargs
@@ -296,7 +370,7 @@ class MovementTransition(Transition):
     def _copy(self, *args, **kwargs):
         raise NotImplementedError()
 
-    def __call__(self, data):
+    def __call__(self, data, frame=None):
         # The implementation depends heavily on the type of movement, this exists only to prevent the parent method from being invoked
         raise NotImplementedError()
 
@@ -322,8 +396,8 @@ class CircleMovementTransition(PanTiltSpreadMixin, MovementTransition):
         self.tilt = tilt
         self.radius = radius
 
-    def _prep_to_copy(self, index, light, data):
-        kwargs = super()._prep_to_copy(index, light, data)
+    def _prep_to_copy(self, index, light, data, now=None):
+        kwargs = super()._prep_to_copy(index, light, data, now)
 
         kwargs.update({
             'pan': self.pan,
@@ -336,10 +410,10 @@ class CircleMovementTransition(PanTiltSpreadMixin, MovementTransition):
     def _copy(self, *args, **kwargs):
         return CircleMovementTransition(*args, **kwargs)
 
-    def __call__(self, data):
+    def __call__(self, data, frame=None):
         if not (self.light.type.functions.get('pan') and self.light.type.functions.get('pan').meta.get('range_deg') and self.light.type.functions.get('tilt') and self.light.type.functions.get('tilt').meta.get('range_deg')):
             return
-        percent = min(1, self._calc_percent(data))
+        percent = min(1, self._calc_percent(data, frame))
         res = self._calc_short_circuit(data, percent)
         if res is None:
             return None
@@ -373,8 +447,8 @@ class PointsMovementTransition(MovementTransition):
     def _calc_points(self):
         raise NotImplementedError("return a list of tuples of points, in degrees")
 
-    def _prep_to_copy(self, index, light, data):
-        kwargs = super()._prep_to_copy(index, light, data)
+    def _prep_to_copy(self, index, light, data, now=None):
+        kwargs = super()._prep_to_copy(index, light, data, now)
 
         kwargs.update({
             'start': self.start,
@@ -385,10 +459,10 @@ class PointsMovementTransition(MovementTransition):
     def _copy(self, *args, **kwargs):
         return PointsMovementTransition(*args, **kwargs)
 
-    def __call__(self, data):
+    def __call__(self, data, frame=None):
         if not (self.light.type.functions.get('pan') and self.light.type.functions.get('pan').meta.get('range_deg') and self.light.type.functions.get('tilt') and self.light.type.functions.get('tilt').meta.get('range_deg')):
             return
-        percent = min(1, self._calc_percent(data))
+        percent = min(1, self._calc_percent(data, frame))
         res = self._calc_short_circuit(data, percent)
         if res is None:
             return None
@@ -434,8 +508,8 @@ class SquareMovementTransition(PanTiltSpreadMixin, PointsMovementTransition):
             points.append(points.pop[2])
         return points
 
-    def _prep_to_copy(self, index, light, data):
-        kwargs = super()._prep_to_copy(index, light, data)
+    def _prep_to_copy(self, index, light, data, now=None):
+        kwargs = super()._prep_to_copy(index, light, data, now)
 
         kwargs.update({
             'pan': self.pan,
@@ -468,8 +542,8 @@ class SweepMovementTransition(PointsMovementTransition):
         ]
         return points
 
-    def _prep_to_copy(self, index, light, data):
-        kwargs = super()._prep_to_copy(index, light, data)
+    def _prep_to_copy(self, index, light, data, now=None):
+        kwargs = super()._prep_to_copy(index, light, data, now)
 
         kwargs.update({
             'x1': self.x1,
@@ -488,24 +562,35 @@ class Effect(Named, HasLightFilter, HasTriggers('select', 'run'), ListOf(Transit
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.lights = None
+        self.evaluator = None
 
-    def for_lights(self, data, lights):
+    def for_lights(self, data, lights, frame=None):
         lights = self._filter_lights(lights)
         transitions = []
         for t in self:
-            transitions += list(t.for_lights(lights, data))
+            transitions += list(t.for_lights(lights, data, frame=frame))
         out = Effect(self.name, *transitions)
         out.lights = lights
+        out.evaluator = BatchEvaluator.for_transitions(out)
         return out
 
+    def is_running_at(self, now):
+        if self.evaluator:
+            return self.evaluator.is_running_at(now)
+        return any((t.is_running_at(now) for t in self))
+
     @property
     def is_running(self):
-        return any((t.is_running for t in self))
+        return self.is_running_at(frame_time())
+
+    def __call__(self, data, frame=None):
+        if self.evaluator:
+            values = self.evaluator(data, frame_time(frame), frame)
+        else:
+            values = (t(data, frame) for t in self)
 
-    def __call__(self, data):
         out = {}
-        for t in self:
-            val = t(data)
+        for t, val in zip(self, values):
             if val is not None:
                 if isinstance(val, dict):
                     out.setdefault(t.light.name, {}).update(val)
@@ -530,10 +615,10 @@ class Program(Named, HasLightFilter, HasTriggers('run', 'stop', 'select', 'next'
             self.loop = (start and not self.autoplay) if loop is None else loop
             self.play_next = False
 
-    def _run_triggers__single(self, data):
+    def _run_triggers__single(self, data, frame):
         selected = None
         for idx, effect in enumerate(self):
-            for name in effect.run_triggers(data):
+            for name in effect.run_triggers(data, frame=frame):
                 if selected is None and name == 'select':
                     selected = idx
 
@@ -541,7 +626,7 @@ class Program(Named, HasLightFilter, HasTriggers('run', 'stop', 'select', 'next'
             self.running_effect = None
             self.current_effect_idx = selected
 
-        for name in super().run_triggers(data):
+        for name in super().run_triggers(data, frame=frame):
             if name == 'run':
                 self.is_running = True
             elif name == 'stop':
@@ -561,20 +646,21 @@ class Program(Named, HasLightFilter, HasTriggers('run', 'stop', 'select', 'next'
                 self.current_effect_idx = random.randint(0, len(self) - 1)
                 self.play_next = True
 
-    def _run_triggers__multi(self, data):
+    def _run_triggers__multi(self, data, frame):
         # Special case - allow running effects to expire before running triggers
         # This can keep an effect that's continually triggered from dropping out for a frame
+        now = frame_time(frame)
         for k, v in list(self.running_effects.items()):
-            if not v.is_running:
+            if not v.is_running_at(now):
                 del self.running_effects[k]
 
         for idx, effect in enumerate(self):
-            for name in effect.run_triggers(data):
+            for name in effect.run_triggers(data, frame=frame):
                 if name == 'run':
                     if idx not in self.pending_effects and idx not in self.running_effects:
                         self.pending_effects[idx] = effect
 
-        for name in super().run_triggers(data):
+        for name in super().run_triggers(data, frame=frame):
             # next/prev do not apply here
             if name == 'run':
                 self.is_running = True
@@ -589,13 +675,13 @@ class Program(Named, HasLightFilter, HasTriggers('run', 'stop', 'select', 'next'
                     self.pending_effects[idx] = self[idx]
 
 
-    def run_triggers(self, data):
+    def run_triggers(self, data, frame=None):
         if self.multiple:
-            yield from self._run_triggers__multi(data)
+            yield from self._run_triggers__multi(data, frame)
         else:
-            yield from self._run_triggers__single(data)
+            yield from self._run_triggers__single(data, frame)
 
-    def _call__single(self, data, lights):
+    def _call__single(self, data, lights, frame):
         if not len(self):
             self.current_effect_idx = self.running_effect = None
             return {}
@@ -606,7 +692,7 @@ class Program(Named, HasLightFilter, HasTriggers('run', 'stop', 'select', 'next'
         if self.current_effect_idx is None:
             self.current_effect_idx = 0
 
-        if self.running_effect is not None and not self.running_effect.is_running:
+        if self.running_effect is not None and not self.running_effect.is_running_at(frame_time(frame)):
             self.running_effect = None
             if self.autoplay:
                 self.current_effect_idx = (self.current_effect_idx + 1) % len(self)
@@ -614,13 +700,13 @@ class Program(Named, HasLightFilter, HasTriggers('run', 'stop', 'select', 'next'
         if self.running_effect is None:
             if self.autoplay or self.loop or self.play_next:
                 self.play_next = False
-                self.running_effect = self[self.current_effect_idx].for_lights(data, lights)
+                self.running_effect = self[self.current_effect_idx].for_lights(data, lights, frame=frame)
             else:
                 return {}
 
-        return self.running_effect(data)
+        return self.running_effect(data, frame)
 
-    def _call__multi(self, data, lights):
+    def _call__multi(self, data, lights, frame):
         # Expired in run_triggers so don't do it here
         # for k, v in list(self.running_effects.items()):
         #     if not v.is_running:
@@ -635,29 +721,29 @@ class Program(Named, HasLightFilter, HasTriggers('run', 'stop', 'select', 'next'
             return {}
 
         for k, v in self.pending_effects.items():
-            self.running_effects[k] = v.for_lights(data, lights)
+            self.running_effects[k] = v.for_lights(data, lights, frame=frame)
         self.pending_effects = {}
 
         out = {}
         for effect in self.running_effects.values():
-            for light, values in effect(data).items():
+            for light, values in effect(data, frame).items():
                 out.setdefault(light, {}).update(values)
 
         return out
 
-    def __call__(self, data, lights):
+    def __call__(self, data, lights, frame=None):
         lights = self._filter_lights(lights)
         if self.multiple:
-            return self._call__multi(data, lights)
+            return self._call__multi(data, lights, frame)
         else:
-            return self._call__single(data, lights)
+            return self._call__single(data, lights, frame)
 
 
 class Scene(Named, HasTriggers('select'), ListOf(Program)):
-    def run_triggers(self, data):
+    def run_triggers(self, data, frame=None):
         selected = None
         for idx, prog in enumerate(self):
-            for name in prog.run_triggers(data):
+            for name in prog.run_triggers(data, frame=frame):
                 if selected is None and name == 'select':
                     selected = idx
 
@@ -667,12 +753,12 @@ class Scene(Named, HasTriggers('select'), ListOf(Program)):
                     prog.is_running = idx == selected
 
         # can only do select - pass up to controller
-        yield from super().run_triggers(data)
+        yield from super().run_triggers(data, frame=frame)
 
-    def __call__(self, data, lights):
+    def __call__(self, data, lights, frame=None):
         out = {}
         for program in self:
-            for light_name, props in program(data, lights).items():
+            for light_name, props in program(data, lights, frame=frame).items():
                 out.setdefault(light_name, {}).update(props)
         return out
 
@@ -681,18 +767,41 @@ class SceneController(HasTriggers('next', 'prev', 'random'), ListOf(Scene)):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.current_scene_idx = 0 if len(self) else None
+        self.frame = None
+        self.trigger_index = TriggerIndex(self)
+
+    def rebuild_trigger_index(self):
+        # Call after adding or removing scenes, programs, effects or triggers
+        self.trigger_index.detach()
+        self.trigger_index = TriggerIndex(self)
+
+    def run_triggers(self, data, frame=None, changed=None):
+        """\
+        Run all triggers and apply the results
+
+        Args:
+        data: Event data, as returned by Input.get_data
+        frame: The current frame
+        changed: Events that changed since the last call (see Input.changed_since), None to re-evaluate every trigger
+        """
+
+        # Everything evaluated in this call sees the same frame time
+        if frame is None:
+            frame = Frame.now()
+        self.frame = frame
+
+        self.trigger_index.update(data, changed, frame=frame)
 
-    def run_triggers(self, data):
         selected = None
         for idx, scene in enumerate(self):
-            for name in scene.run_triggers(data):
+            for name in scene.run_triggers(data, frame=frame):
                 if selected is None and name == 'select':
                     selected = idx
 
         if selected is not None:
             self.current_scene_idx = selected
 
-        for name in super().run_triggers(data):
+        for name in super().run_triggers(data, frame=frame):
             if name == 'next':
                 self.current_scene_idx = (self.current_scene_idx + 1) % len(self)
             elif name == 'prev':
@@ -700,7 +809,11 @@ class SceneController(HasTriggers('next', 'prev', 'random'), ListOf(Scene)):
             elif name == 'random':
                 self.current_scene_idx = random.randint(0, len(self) - 1)
 
-    def __call__(self, data, lights):
+    def __call__(self, data, lights, frame=None):
+        if frame is None:
+            frame = Frame.now()
+        self.frame = frame
+
         if not len(self):
             self.current_scene_idx = None
             return {}
@@ -708,36 +821,59 @@ class SceneController(HasTriggers('next', 'prev', 'random'), ListOf(Scene)):
         if self.current_scene_idx is None:
             self.current_scene_idx = 0
 
-        return self[self.current_scene_idx](data, lights)
+        return self[self.current_scene_idx](data, lights, frame=frame)
 
 
 class Trigger:
-    def __init__(self, event, threshold, value='new', below_threshold=False, cooldown=None, cooldown_beat=None):
+    def __init__(self, event, threshold, value='new', below_threshold=False, cooldown=None, cooldown_beat=None, window=None, window_beat=None):
+        """\
+        Args:
+        value: Which value of the event to compare - new, old, diff or percent, or one of HISTORY_STATS for a value
+            over the event's recent history
+        window, window_beat: For history values, how far back to look in seconds or beats, None for the whole history
+        """
+
         self.event = event
+        self.event_id = events.intern(event)
         self.threshold = threshold
         self.value = value
+        self.window = window
+        self.window_beat = window_beat
         self.below_threshold = below_threshold
         self.cooldown = cooldown
         self.cooldown_beat = cooldown_beat
         self.next_trigger = None
+        # Last result, used when evaluated through a TriggerIndex
+        self.result = None
 
-    def __call__(self, data):
-        if self.next_trigger is not None and time.time() < self.next_trigger:
-            return None
+    @property
+    def windowed(self):
+        # Windowed history values change as samples age out, even when the event doesn't update
+        return self.value in ('mean', 'min', 'max') and bool(self.window or self.window_beat)
 
-        res = data.get(self.event)
-        if not res:
+    def __call__(self, data, frame=None):
+        now = frame_time(frame)
+        if self.next_trigger is not None and now < self.next_trigger:
             return None
 
-        new_v, old_v, diff, diff_p = res
+        if self.value in HISTORY_STATS:
+            v = get_history_value(data, self.event_id, self.value, self.window, self.window_beat, now)
+            if v is None:
+                return None
+        else:
+            res = data.get(self.event_id)
+            if not res:
+                return None
 
-        v = new_v
-        if self.value == 'old':
-            v = old_v
-        elif self.value == 'diff':
-            v = diff
-        elif self.value == 'percent':
-            v = diff_p
+            new_v, old_v, diff, diff_p = res
+
+            v = new_v
+            if self.value == 'old':
+                v = old_v
+            elif self.value == 'diff':
+                v = diff
+            elif self.value == 'percent':
+                v = diff_p
 
         if self.below_threshold:
             out = v < self.threshold
@@ -746,26 +882,119 @@ class Trigger:
 
         if out and self.cooldown:
             cooldown = get_bpm_duration(data, self.cooldown_beat) or self.cooldown
-            self.next_trigger = time.time() + cooldown
+            self.next_trigger = now + cooldown
 
         return out
 
     @classmethod
-    def run_trigger_group(cls, data, triggers):
+    def run_trigger_group(cls, data, triggers, frame=None, cached=False):
+        # With cached=True, use each trigger's last result instead of evaluating it
+        check = (lambda t: t.result) if cached else (lambda t: t(data, frame))
         for trigger in triggers:
             try:
                 iter(trigger)
             except:
                 # Outer list is an OR condition
-                if trigger is True or trigger(data):
+                if trigger is True or check(trigger):
                     return True
             else:
                 # inner lists are an AND condition
-                if all((t is True or t(data) for t in trigger)):
+                if all((t is True or check(t) for t in trigger)):
                     return True
 
         return False
 
 
+class TriggerIndex:
+    """\
+    Maps events to the triggers that depend on them, so each frame only re-evaluates triggers whose events changed
+
+    Triggers in cooldown are kept on a heap and re-evaluated when the cooldown expires, triggers on windowed history
+    values are re-evaluated every frame.  Trigger groups are only re-evaluated when one of their triggers was,
+    everything else keeps its last result.
+    """
+
+    def __init__(self, root):
+        self.owners = []
+        self.groups = {}
+        self.groups_by_trigger = {}
+        self.by_event = {}
+        self.windowed = set()
+        self.cooldowns = []
+        self.cooling = []
+        self.primed = False
+        self._walk(root)
+
+    def _walk(self, obj):
+        triggers = getattr(obj, 'triggers', None)
+        if isinstance(triggers, dict):
+            obj.trigger_index = self
+            self.owners.append(obj)
+            for group in triggers.values():
+                self._add_group(group)
+        if isinstance(obj, list):
+            for item in obj:
+                self._walk(item)
+
+    def _add_group(self, group):
+        self.groups[id(group)] = [group, False]
+        for trigger in group:
+            for t in (trigger if is_iterable(trigger) else [trigger]):
+                if t is True:
+                    continue
+                self.groups_by_trigger.setdefault(t, []).append(group)
+                self.by_event.setdefault(t.event_id, set()).add(t)
+                if t.windowed:
+                    self.windowed.add(t)
+
+    def detach(self):
+        for obj in self.owners:
+            if obj.trigger_index is self:
+                obj.trigger_index = None
+
+    def group_result(self, group):
+        return self.groups[id(group)][1]
+
+    def update(self, data, changed=None, frame=None):
+        # Re-evaluate triggers for the changed events (all of them if changed is None), windowed triggers and any
+        # expired cooldowns
+        now = frame_time(frame)
+        if not self.primed:
+            # Nothing has been evaluated yet
+            changed = None
+            self.primed = True
+        if changed is None:
+            due = set(self.groups_by_trigger)
+        else:
+            due = set(self.windowed)
+            for event in changed:
+                due.update(self.by_event.get(event, ()))
+
+        while self.cooldowns and self.cooldowns[0][0] <= now:
+            due.add(heapq.heappop(self.cooldowns)[2])
+
+        dirty = {} if changed is not None else {k: v[0] for k, v in self.groups.items()}
+
+        # Triggers that fired last frame and went into cooldown stop firing until the cooldown expires
+        for trigger in self.cooling:
+            if trigger not in due:
+                trigger.result = None
+                for group in self.groups_by_trigger[trigger]:
+                    dirty[id(group)] = group
+        self.cooling = []
+
+        for trigger in due:
+            last_next = trigger.next_trigger
+            trigger.result = trigger(data, frame)
+            if trigger.next_trigger != last_next and trigger.next_trigger > now:
+                heapq.heappush(self.cooldowns, (trigger.next_trigger, id(trigger), trigger))
+                self.cooling.append(trigger)
+            for group in self.groups_by_trigger.get(trigger, ()):
+                dirty[id(group)] = group
+
+        for key, group in dirty.items():
+            self.groups[key][1] = Trigger.run_trigger_group(data, group, frame=frame, cached=True)
+
+
 class Mood:
     pass
@@ -0,0 +1,84 @@
+"""\
+Shared lookup tables for easing functions
+
+Each named easing is sampled once over 0..1 and evaluated by linear interpolation, so transitions only need to keep
+the ID of their table.  numpy is optional and only used by evaluate_many.
+"""
+
+import easing_functions
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+DEFAULT_RESOLUTION = 1024
+
+_resolution = DEFAULT_RESOLUTION
+_tables = []
+_ids = {}
+
+
+class EasingTable:
+    def __init__(self, name, resolution):
+        fn = getattr(easing_functions, name)(start=0.0, end=1.0, duration=1.0)
+        self.name = name
+        self.resolution = resolution
+        # Linear needs no table, the percent is the value
+        self.linear = type(fn) is easing_functions.LinearInOut
+        self.samples = [fn(i / resolution) for i in range(resolution + 1)]
+        self.array = None if np is None else np.array(self.samples, dtype=float)
+
+    def __call__(self, percent):
+        if self.linear:
+            return percent
+        if percent <= 0:
+            return self.samples[0]
+        if percent >= 1:
+            return self.samples[-1]
+        pos = percent * self.resolution
+        i = min(int(pos), self.resolution - 1)
+        a = self.samples[i]
+        return a + ((self.samples[i + 1] - a) * (pos - i))
+
+    def evaluate_many(self, percents):
+        # Same interpolation as __call__ over a numpy array, percents must already be clipped to 0..1
+        if self.linear:
+            return percents
+        pos = percents * self.resolution
+        i = np.minimum(pos.astype(int), self.resolution - 1)
+        a = self.array[i]
+        return a + ((self.array[i + 1] - a) * (pos - i))
+
+
+def set_resolution(resolution):
+    # Change the number of samples per table, existing tables are rebuilt and keep their IDs
+    global _resolution
+    if resolution < 1:
+        raise ValueError("resolution must be at least 1")
+    _resolution = int(resolution)
+    for i, table in enumerate(_tables):
+        _tables[i] = EasingTable(table.name, _resolution)
+
+
+def get_resolution():
+    return _resolution
+
+
+def get_id(name):
+    # Unknown names fall back to linear, like they always have
+    if not hasattr(easing_functions, name or ''):
+        name = 'LinearInOut'
+    if name not in _ids:
+        _ids[name] = len(_tables)
+        _tables.append(EasingTable(name, _resolution))
+    return _ids[name]
+
+
+def get_table(easing_id):
+    return _tables[easing_id]
+
+
+def evaluate(easing_id, percent):
+    return _tables[easing_id](percent)
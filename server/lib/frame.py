@@ -0,0 +1,157 @@
+"""\
+Fixed-rate frame scheduling for the main loop
+"""
+
+import time
+
+
+_clock = time.monotonic
+
+
+def set_clock(clock):
+    # Replace the clock used for frame times everywhere, e.g. with a SimulatedClock for offline rendering
+    global _clock
+    _clock = clock
+
+
+def get_clock():
+    return _clock
+
+
+def frame_time(frame=None):
+    # The time of the given frame, or the current clock time when called outside of a frame
+    return _clock() if frame is None else frame.time
+
+
+class SimulatedClock:
+    """\
+    A clock that only moves when told to, so frames can be rendered faster (or slower) than real time
+    """
+
+    def __init__(self, start=0.0):
+        self.time = start
+
+    def __call__(self):
+        return self.time
+
+    def advance(self, seconds):
+        self.time += seconds
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.time += seconds
+
+
+class Frame:
+    """\
+    Context for a single tick of the main loop, passed down to the controller
+    """
+
+    def __init__(self, index, time, deadline, dt, late=0.0, skipped=0):
+        """\
+        Args:
+        index: Frame slot number, counting skipped slots
+        time: Clock time the frame started at
+        deadline: The time this frame was scheduled for
+        dt: Time since the previous frame started
+        late: How far past its deadline the frame started
+        skipped: Number of frame slots dropped immediately before this frame
+        """
+
+        self.index = index
+        self.time = time
+        self.deadline = deadline
+        self.dt = dt
+        self.late = late
+        self.skipped = skipped
+
+    @classmethod
+    def now(cls):
+        # A standalone frame at the current clock time, for callers that are not driven by a scheduler
+        t = _clock()
+        return cls(None, t, t, 0.0)
+
+    def __repr__(self):
+        return '<Frame {} t={:.4f} dt={:.4f} late={:.4f} skipped={}>'.format(self.index, self.time, self.dt, self.late, self.skipped)
+
+
+class FrameScheduler:
+    """\
+    Paces the main loop at a fixed frame rate
+
+    Deadlines are computed from the previous deadline rather than from when the frame actually ran, so timing error
+    does not accumulate.  When a frame starts more than a full period late, the late policy decides what happens:
+    SKIP drops the missed slots and resumes on the grid, CATCHUP runs the missed frames back to back (up to
+    max_catchup seconds behind, after which the schedule is reset).
+    """
+
+    SKIP = 'skip'
+    CATCHUP = 'catchup'
+
+    def __init__(self, fps=70.0, late_policy=SKIP, max_catchup=1.0, clock=None, sleep=None):
+        if fps <= 0:
+            raise ValueError("fps must be positive")
+        if late_policy not in (self.SKIP, self.CATCHUP):
+            raise ValueError(f"Invalid late policy: {late_policy}")
+
+        self.fps = fps
+        self.period = 1.0 / fps
+        self.late_policy = late_policy
+        self.max_catchup = max_catchup
+        # Defaults to the global clock, and to the clock's own sleep if it has one (see SimulatedClock)
+        self.clock = clock or get_clock()
+        self.sleep = sleep or getattr(self.clock, 'sleep', time.sleep)
+
+        self.index = 0
+        self.next_deadline = None
+        self.last_time = None
+        self.total_skipped = 0
+
+    def reset(self):
+        self.index = 0
+        self.next_deadline = None
+        self.last_time = None
+
+    def next_delay(self):
+        # Seconds until the next frame is due, 0 if it is already due
+        if self.next_deadline is None:
+            return 0
+        return max(0, self.next_deadline - self.clock())
+
+    def tick(self):
+        # Start a frame now, without waiting for its deadline
+        now = self.clock()
+        if self.next_deadline is None:
+            self.next_deadline = now
+
+        deadline = self.next_deadline
+        late = now - deadline
+        skipped = 0
+        if late >= self.period:
+            if self.late_policy == self.SKIP:
+                skipped = int(late // self.period)
+            elif late > self.max_catchup:
+                # Too far behind to catch up - start a new schedule from here
+                skipped = int(late // self.period)
+            deadline += skipped * self.period
+            late = now - deadline
+
+        self.index += skipped
+        self.total_skipped += skipped
+        frame = Frame(self.index, now, deadline, 0.0 if self.last_time is None else now - self.last_time, late=late, skipped=skipped)
+
+        self.index += 1
+        self.next_deadline = deadline + self.period
+        self.last_time = now
+        return frame
+
+    def wait(self):
+        # Block until the next frame is due, then start it
+        delay = self.next_delay()
+        if delay > 0:
+            self.sleep(delay)
+        return self.tick()
+
+    def __iter__(self):
+        while True:
+            yield self.wait()
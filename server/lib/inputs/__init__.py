@@ -1,9 +1,19 @@
 import itertools
-import time
-from queue import Queue, Empty
-from threading import RLock
+from collections import deque
+from collections.abc import Mapping
+from threading import Lock, RLock
 
-from lib import HasThread, fps
+from lib import HasThread, metrics
+from lib.frame import get_clock
+from lib.inputs import events
+from lib.inputs.history import EventHistory
+
+
+# The event cache is a list of fixed size chunks of event IDs, so a new version only copies the list of chunks and the
+# chunks holding changed events, the rest are shared with earlier versions
+CHUNK_BITS = 6
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
 
 
 def calcdiff(new, old):
@@ -36,36 +46,230 @@ def calcdiff(new, old):
     return out_old, diff, diff_p
 
 
+class EventData(Mapping):
+    """\
+    Read-only event data as of one version of the input cache
+
+    A new EventData is published only when events change, so holding on to one is safe and getting it is free.
+    Events may be looked up by ID (see lib.inputs.events) or by name, iterating gives names.
+    """
+
+    def __init__(self, chunks, version, stats=None, histories=None):
+        # Chunks of values (see CHUNK_SIZE) indexed by event ID, None for events with no value yet
+        self._chunks = chunks
+        self.version = version
+        # {event: (min, max, count)} of the values received for each event in this version, if Input.collect_stats
+        self.stats = stats or {}
+        self._histories = [] if histories is None else histories
+
+    def _get(self, key):
+        if type(key) is not int:
+            key = events.get_id(key)
+            if key is None:
+                return None
+        chunk = key >> CHUNK_BITS
+        return self._chunks[chunk][key & CHUNK_MASK] if chunk < len(self._chunks) else None
+
+    def __getitem__(self, key):
+        value = self._get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._get(key)
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return self._get(key) is not None
+
+    def _ids(self):
+        for n, chunk in enumerate(self._chunks):
+            for i, v in enumerate(chunk):
+                if v is not None:
+                    yield (n << CHUNK_BITS) + i
+
+    def __iter__(self):
+        return (events.get_name(i) for i in self._ids())
+
+    def __len__(self):
+        return sum(1 for _ in self._ids())
+
+    def history(self, event):
+        # EventHistory of an event's recent values, or None - unlike the data this is live, not a snapshot
+        if type(event) is not int:
+            event = events.get_id(event)
+            if event is None:
+                return None
+        return self._histories[event] if event < len(self._histories) else None
+
+    def __repr__(self):
+        return '<EventData v{} {}>'.format(self.version, dict(self.items()))
+
+
+class _StatsSlot(list):
+    # [latest, min, max, count] for an event, distinguishes stats from event args that happen to be lists
+    pass
+
+
 class Input(HasThread):
-    output_queue = Queue()
-    event_cache = {}
+    # (args, old, diff, diff_p) of each event indexed by event ID, None for events with no value yet, in chunks of
+    # CHUNK_SIZE.  Chunks in event_cache_owned haven't been published yet and may be written in place, the others are
+    # shared with snapshots and copied before writing
+    event_cache = []
+    event_cache_owned = set()
     event_cache_lock = RLock()
+    # Latest value of each event ID received since the last frame, written by input threads
+    slots = {}
+    slots_lock = Lock()
+    # Also track min/max/count of the values received for each event within a frame
+    collect_stats = False
+    # Recorders (see lib.inputs.recording) that get every ingested event
+    recorders = []
+    # Published snapshot, and the events changed by each recent version as (version, events)
+    snapshot = EventData([], 0)
+    version_log = deque(maxlen=256)
+    # EventHistory of each numeric event indexed by event ID, for windowed values - history_size of 0 disables them
+    histories = []
+    history_size = 256
+    history_ema_alpha = 0.1
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    @classmethod
+    def ingest(self, event, args):
+        # Called by input threads for each message - only the latest value of each event is kept until the next frame
+        # event may be a name or an ID from lib.inputs.events
+        with self.slots_lock:
+            self._ingest(event, args)
+        # Recorders have their own locks, the render loop shouldn't wait on them
+        for recorder in self.recorders:
+            recorder.record(event, args)
+        metrics.count('input.events')
+
+    @classmethod
+    def ingest_many(self, events):
+        # Like ingest for an iterable of (event, args), taking the lock once
+        if self.recorders:
+            events = list(events)
+        n = 0
+        with self.slots_lock:
+            for event, args in events:
+                self._ingest(event, args)
+                n += 1
+        for recorder in self.recorders:
+            for event, args in events:
+                recorder.record(event, args)
+        metrics.count('input.events', n)
+
+    @classmethod
+    def _ingest(self, event, args):
+        if type(event) is not int:
+            event = events.intern(event)
+        if not self.collect_stats:
+            Input.slots[event] = args
+            return
+        slot = Input.slots.get(event)
+        if slot is None:
+            Input.slots[event] = _StatsSlot((args, args, args, 1))
+            return
+        slot[0] = args
+        slot[3] += 1
+        try:
+            slot[1] = min(slot[1], args)
+            slot[2] = max(slot[2], args)
+        except TypeError:
+            pass
+
     @classmethod
     def process_events(self, timeout=None):
-        start = time.time()
-        while True:
-            try:
-                event, args = self.output_queue.get(block=False)
-                last_args = self.event_cache.get(event)
+        # timeout is accepted for compatibility, the work here is bounded by the number of distinct events
+        with metrics.Timer('input.process_events'):
+            self._process_events()
+
+    @classmethod
+    def _process_events(self):
+        with self.slots_lock:
+            slots = Input.slots
+            Input.slots = {}
+        if not slots:
+            return
+
+        stats = {}
+        now = get_clock()()
+        with self.event_cache_lock:
+            cache = self.event_cache
+            owned = self.event_cache_owned
+            while len(cache) << CHUNK_BITS < len(events.registry):
+                owned.add(len(cache))
+                cache.append([None] * CHUNK_SIZE)
+            for event, args in slots.items():
+                if type(args) is _StatsSlot:
+                    args, low, high, count = args
+                    stats[events.get_name(event)] = (low, high, count)
+                n = event >> CHUNK_BITS
+                chunk = cache[n]
+                if n not in owned:
+                    chunk = cache[n] = list(chunk)
+                    owned.add(n)
+                last_args = chunk[event & CHUNK_MASK]
                 if last_args:
                     last_args = last_args[0]
                 old, diff, diff_p = calcdiff(args, last_args)
-                with self.event_cache_lock:
-                    self.event_cache[event] = (args, old, diff, diff_p)
-                # return event, args, old, diff, diff_p
-                if timeout is not None and time.time() - start >= timeout:
-                    fps.count('InputTimeout')
-                    break
-            except Empty:
-                break
+                chunk[event & CHUNK_MASK] = (args, old, diff, diff_p)
+                if self.history_size:
+                    self._record_history(event, args, now)
+
+        self.publish(slots.keys(), stats)
+
+    @classmethod
+    def _record_history(self, event, args, now):
+        # Multi-value events are tracked by their first value, like @event transition values
+        if isinstance(args, (tuple, list)):
+            if not args:
+                return
+            args = args[0]
+        if not isinstance(args, (int, float)):
+            return
+        histories = self.histories
+        if event >= len(histories):
+            histories.extend([None] * (event + 1 - len(histories)))
+        history = histories[event]
+        if history is None:
+            history = histories[event] = EventHistory(self.history_size, self.history_ema_alpha)
+        history.push(now, args)
+
+    @classmethod
+    def publish(self, changed, stats=None):
+        # Make the current cache visible to get_data as a new version, sharing its chunks - they're copied again before
+        # the next write
+        with self.event_cache_lock:
+            version = self.snapshot.version + 1
+            self.version_log.append((version, frozenset(changed)))
+            self.event_cache_owned.clear()
+            Input.snapshot = EventData(list(self.event_cache), version, stats, self.histories)
 
     @classmethod
     def get_data(self, process=True, timeout=None):
         if process:
             self.process_events(timeout=timeout)
+        return self.snapshot
+
+    @classmethod
+    def changed_since(self, version):
+        # IDs of events changed after the given version, or None if that is too old to tell (treat everything as changed)
         with self.event_cache_lock:
-            return dict(self.event_cache)
+            current = self.snapshot.version
+            if version is None or version > current:
+                return None
+            if version == current:
+                return set()
+            if not self.version_log or self.version_log[0][0] > version + 1:
+                return None
+            out = set()
+            for v, events in reversed(self.version_log):
+                if v <= version:
+                    break
+                out.update(events)
+            return out
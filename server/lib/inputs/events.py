@@ -0,0 +1,43 @@
+"""\
+Registry interning event names to small integer IDs
+
+Flavors and config intern their event names when they're loaded, after which the input cache, triggers and @event
+references index arrays by ID instead of hashing names every frame.  IDs are only stable within a process.
+"""
+
+from threading import Lock
+
+
+class EventRegistry:
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        # ID for an event name, registering it if it's new
+        event_id = self.ids.get(name)
+        if event_id is None:
+            with self.lock:
+                event_id = self.ids.get(name)
+                if event_id is None:
+                    event_id = len(self.names)
+                    self.names.append(name)
+                    self.ids[name] = event_id
+        return event_id
+
+    def get_id(self, name):
+        # ID for an event name, None if it was never registered
+        return self.ids.get(name)
+
+    def get_name(self, event_id):
+        return self.names[event_id]
+
+
+registry = EventRegistry()
+intern = registry.intern
+get_id = registry.get_id
+get_name = registry.get_name
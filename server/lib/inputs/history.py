@@ -0,0 +1,152 @@
+"""\
+Fixed-size history of recent values for an event, for windowed features like rolling averages
+"""
+
+from array import array
+from collections import deque
+
+
+class _MinMaxWindow:
+    # Monotonic queues of (sequence number, time, value), values increasing for minq and decreasing for maxq.  Entries
+    # leave the front as they fall out of the ring buffer or the time window, so the front is always the answer.
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.minq = deque()
+        self.maxq = deque()
+
+    def push(self, seq, time, value):
+        minq, maxq = self.minq, self.maxq
+        while minq and minq[-1][2] >= value:
+            minq.pop()
+        minq.append((seq, time, value))
+        while maxq and maxq[-1][2] <= value:
+            maxq.pop()
+        maxq.append((seq, time, value))
+
+    def expire(self, oldest, now=None):
+        # Drop entries before sequence number oldest, or before now - seconds.  now must not go backwards.
+        cutoff = None if self.seconds is None or now is None else now - self.seconds
+        for queue in (self.minq, self.maxq):
+            while queue and (queue[0][0] < oldest or (cutoff is not None and queue[0][1] < cutoff)):
+                queue.popleft()
+
+
+class EventHistory:
+    """\
+    Ring buffer of (time, value) samples with running aggregates
+
+    Over the whole buffer, mean/min/max are O(1) (a running sum and monotonic min/max queues) and the EMA is updated
+    per sample.  A time window (seconds) ends at now, which should be the current frame time so windowed values keep
+    moving when the event stops updating - it defaults to the latest sample's time.  The mean over a window bisects
+    the sample times for its start and takes a prefix sum difference.  Each window size queried gets its own min/max
+    queues, updated on push and trimmed from the front as time advances, so windowed min/max are amortized O(1).
+    """
+
+    # Number of window sizes min/max queues are kept for, beat windows change size with the BPM
+    max_windows = 8
+
+    def __init__(self, size=256, ema_alpha=0.1):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.size = size
+        self.ema_alpha = ema_alpha
+        self.times = array('d', bytes(8 * size))
+        self.values = array('d', bytes(8 * size))
+        # Sum of all values up to and including each sample
+        self.sums = array('d', bytes(8 * size))
+        self.count = 0
+        self.total = 0.0
+        self.ema = None
+        # {seconds: _MinMaxWindow}, None is the whole buffer
+        self._windows = {None: _MinMaxWindow(None)}
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def push(self, time, value):
+        seq = self.count
+        i = seq % self.size
+        self.total += value
+        self.times[i] = time
+        self.values[i] = value
+        self.sums[i] = self.total
+        self.count += 1
+
+        oldest = self.count - self.size
+        for window in self._windows.values():
+            window.push(seq, time, value)
+            window.expire(oldest)
+
+        self.ema = value if self.ema is None else self.ema + (self.ema_alpha * (value - self.ema))
+
+    @property
+    def last(self):
+        return self.values[(self.count - 1) % self.size] if self.count else None
+
+    def _now(self, now):
+        return self.times[(self.count - 1) % self.size] if now is None else now
+
+    def _start(self, seconds, now=None):
+        # Sequence number of the first sample in the window, or count if it has none
+        oldest = max(0, self.count - self.size)
+        if seconds is None:
+            return oldest
+        cutoff = self._now(now) - seconds
+        low, high = oldest, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.times[mid % self.size] < cutoff:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def mean(self, seconds=None, now=None):
+        if not self.count:
+            return None
+        start = self._start(seconds, now)
+        if start == self.count:
+            return None
+        i = start % self.size
+        before = self.sums[i] - self.values[i]
+        return (self.total - before) / (self.count - start)
+
+    def _window(self, seconds):
+        if seconds is not None:
+            # Beat windows are converted from the BPM, don't keep queues for every rounding error
+            seconds = round(seconds, 3)
+        window = self._windows.get(seconds)
+        if window is None:
+            if len(self._windows) > self.max_windows:
+                # Evict the oldest window size (never the whole buffer, which was added first)
+                del self._windows[next(k for k in self._windows if k is not None)]
+            window = self._windows[seconds] = _MinMaxWindow(seconds)
+            for seq in range(max(0, self.count - self.size), self.count):
+                i = seq % self.size
+                window.push(seq, self.times[i], self.values[i])
+        return window
+
+    def _minmax(self, seconds, now, use_max):
+        if not self.count:
+            return None
+        window = self._window(seconds)
+        window.expire(self.count - self.size, self._now(now))
+        queue = window.maxq if use_max else window.minq
+        return queue[0][2] if queue else None
+
+    def min(self, seconds=None, now=None):
+        return self._minmax(seconds, now, False)
+
+    def max(self, seconds=None, now=None):
+        return self._minmax(seconds, now, True)
+
+    def get(self, stat, seconds=None, now=None):
+        # stat is one of last, mean, min, max, ema
+        if stat == 'last':
+            return self.last
+        if stat == 'ema':
+            return self.ema
+        if stat in ('mean', 'min', 'max'):
+            return getattr(self, stat)(seconds, now)
+        raise ValueError(f"Unknown history stat: {stat}")
@@ -2,13 +2,14 @@
 OSC input base classes
 """
 
+import re
 import time
 
 from pythonosc.dispatcher import Dispatcher
 from pythonosc.osc_server import BlockingOSCUDPServer
 
 from lib import HasThread
-from lib.inputs import Input
+from lib.inputs import Input, events
 
 
 class OSCAddress:
@@ -35,6 +36,7 @@ class OSCAddress:
         self.event_args = event_args or addr_args
         self.description = description
         self.mapper = mapper or self._default_mapper
+        self.convert = None
 
     def __str__(self):
         out = "{} ({}) -> {} ({})".format(
@@ -46,8 +48,12 @@ class OSCAddress:
         if self.description:
             out += ': ' + self.description
 
-    def _default_mapper(self, address, *args):
-        return self.event, args
+    def _default_mapper(self, address, *args, **params):
+        # Parameters from the address pattern are substituted into the event name
+        event = self.event
+        for k, v in params.items():
+            event = event.replace('<' + k + '>', v)
+        return event, args
 
     def _pre_map_args(self, args):
         for a, t in zip(args, self.addr_args):
@@ -57,29 +63,205 @@ class OSCAddress:
         for a, t in zip(args, self.event_args):
             yield t(a)
 
-    def __call__(self, address, *args):
+    def __call__(self, address, *args, params=None):
         args = self._pre_map_args(args)
-        event, args = self.mapper(address, *args)
+        if params:
+            event, args = self.mapper(address, *args, **params)
+        else:
+            event, args = self.mapper(address, *args)
         args = self._post_map_args(args)
         return event, tuple(args)
 
+    @staticmethod
+    def _event_value(args):
+        # The value passed to Input.ingest: a single argument unwrapped, None for no arguments
+        if len(args) == 1:
+            return args[0]
+        if len(args) == 0:
+            return None
+        return tuple(args)
+
+    def compile(self):
+        """\
+        Build self.convert, which accepts (address, args, params) and returns (event, value) ready for Input.ingest
+
+        Same result as calling this object and unwrapping the args, with fast paths when the default mapper is used.
+        Events without parameters are interned now and returned as their ID, otherwise as a name.
+        """
+
+        if self.mapper != self._default_mapper:
+            def convert(address, args, params=None):
+                event, args = self(address, *args, params=params)
+                return event, self._event_value(args)
+            self.convert = convert
+            return
+
+        event = self.event
+        if '<' not in event:
+            event = events.intern(event)
+        # Each argument goes through its address type and then its event type
+        types = [(p,) if p is q else (p, q) for p, q in zip(self.addr_args, self.event_args)]
+
+        def convert(address, args, params=None):
+            out = []
+            for a, conv in zip(args, types):
+                for t in conv:
+                    a = t(a)
+                out.append(a)
+            return (self._default_mapper(address, **params)[0] if params else event), self._event_value(out)
+
+        if types == [(float,)]:
+            general = convert
+
+            def convert(address, args, params=None):
+                if args and not params:
+                    return event, float(args[0])
+                return general(address, args, params)
+
+        self.convert = convert
+
+
+class AddressTrie:
+    """\
+    Matches concrete OSC addresses against address patterns, one path segment per level
+
+    Patterns may use OSC pattern syntax (*, ?, [abc], [!a-z], {foo,bar}) and named parameters (<name>) within a
+    segment.  Literal segments are tried before patterns, patterns in the order they were added.
+    """
+
+    PATTERN_CHARS = re.compile(r'[*?\[\]{}<>]')
+
+    def __init__(self):
+        self.children = {}
+        self.patterns = []
+        self.address = None
+
+    @classmethod
+    def is_pattern(cls, address):
+        return bool(cls.PATTERN_CHARS.search(address))
+
+    @staticmethod
+    def _compile_segment(segment):
+        out = ''
+        i = 0
+        while i < len(segment):
+            c = segment[i]
+            if c == '*':
+                out += '[^/]*'
+            elif c == '?':
+                out += '[^/]'
+            elif c == '[':
+                end = segment.index(']', i)
+                chars = segment[i + 1:end]
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+                out += '[' + chars.replace('\\', '\\\\') + ']'
+                i = end
+            elif c == '{':
+                end = segment.index('}', i)
+                out += '(?:' + '|'.join(map(re.escape, segment[i + 1:end].split(','))) + ')'
+                i = end
+            elif c == '<':
+                end = segment.index('>', i)
+                out += '(?P<' + segment[i + 1:end] + '>[^/]+)'
+                i = end
+            else:
+                out += re.escape(c)
+            i += 1
+        return re.compile(out + '$')
+
+    def add(self, osc_address):
+        node = self
+        for segment in osc_address.address.strip('/').split('/'):
+            if self.is_pattern(segment):
+                for source, _, child in node.patterns:
+                    if source == segment:
+                        break
+                else:
+                    child = AddressTrie()
+                    node.patterns.append((segment, self._compile_segment(segment), child))
+            else:
+                child = node.children.setdefault(segment, AddressTrie())
+            node = child
+        node.address = osc_address
+
+    def match(self, address):
+        # Returns (OSCAddress, params), or (None, None) if nothing matches
+        params = {}
+        found = self._match(address.strip('/').split('/'), 0, params)
+        if found is None:
+            return None, None
+        return found, params
+
+    def _match(self, segments, i, params):
+        if i == len(segments):
+            return self.address
+
+        segment = segments[i]
+        child = self.children.get(segment)
+        if child is not None:
+            found = child._match(segments, i + 1, params)
+            if found is not None:
+                return found
+
+        for _, pattern, child in self.patterns:
+            m = pattern.match(segment)
+            if m:
+                found = child._match(segments, i + 1, params)
+                if found is not None:
+                    params.update(m.groupdict())
+                    return found
+        return None
+
 
 class OSCFlavor:
     """\
     A "flavor" of OSC, mapping OSC events to internal events
+
+    Addresses in EVENTS may be patterns (see AddressTrie), matches are cached per concrete address.
     """
 
     EVENTS = []
+    # Max number of concrete addresses to cache pattern matches for, the cache is reset when full
+    CACHE_SIZE = 4096
 
     def __init__(self):
-        self._addr_map = {a.address: a for a in self.EVENTS}
+        self._addr_map = {}
+        self._trie = AddressTrie()
+        for a in self.EVENTS:
+            if AddressTrie.is_pattern(a.address):
+                self._trie.add(a)
+            else:
+                self._addr_map[a.address] = a
+            a.compile()
+        self._cache = {}
 
-    def __call__(self, address, *args):
+    def match(self, address):
+        # Returns (OSCAddress, params) for an incoming address, or (None, None)
         addr = self._addr_map.get(address)
+        if addr:
+            return addr, None
+        res = self._cache.get(address)
+        if res is None:
+            res = self._trie.match(address)
+            if len(self._cache) >= self.CACHE_SIZE:
+                self._cache.clear()
+            self._cache[address] = res
+        return res
+
+    def __call__(self, address, *args):
+        addr, params = self.match(address)
         if not addr:
             # TODO: log
             return None, None
-        return addr(address, *args)
+        return addr(address, *args, params=params)
+
+    def convert(self, address, args):
+        # Like calling the flavor, but returns the final (event, value) for Input.ingest - (None, None) if unknown
+        addr, params = self.match(address)
+        if not addr:
+            return None, None
+        return addr.convert(address, args, params)
 
 
 class _OSCBlockingServer(HasThread):
@@ -98,13 +280,9 @@ class _OSCBlockingServer(HasThread):
         self.server.serve_forever()
 
     def osc_handler(self, address, *args):
-        event, event_args = self.osc_flavor(address, *args)
-        if len(event_args) == 1:
-            event_args = event_args[0]
-        elif len(event_args) == 0:
-            event_args = None
-
-        self.osc_input.output_queue.put((event, event_args))
+        event, value = self.osc_flavor.convert(address, args)
+        if event is not None:
+            self.osc_input.ingest(event, value)
 
 
 class OSCServerInput(Input):
@@ -0,0 +1,176 @@
+"""\
+OSC input reading datagrams in batches from a non-blocking UDP socket
+
+Decodes OSC directly instead of going through pythonosc's server and dispatcher: addresses known to the flavor are
+unpacked with a struct format compiled from their argument types, anything else goes through a generic decoder.
+"""
+
+import select
+import socket
+import struct
+
+from lib.inputs import Input
+
+
+# Python argument types to (OSC type tag, struct format), for precompiling formats
+TYPE_TAGS = {
+    float: ('f', 'f'),
+    int: ('i', 'i'),
+}
+
+_INT32 = struct.Struct('>i')
+_BUNDLE = b'#bundle\0'
+# Deepest nesting of bundles decoded, deeper elements are dropped
+MAX_BUNDLE_DEPTH = 8
+
+
+def _pad(n):
+    # Length rounded up to a multiple of 4
+    return (n + 4) & ~3
+
+
+def _read_string(data, offset):
+    end = data.index(b'\0', offset)
+    return data[offset:end].decode('utf-8', 'replace'), offset + _pad(end - offset)
+
+
+class OSCDecoder:
+    """\
+    Decodes OSC packets into (address, args) messages
+    """
+
+    def __init__(self, flavor):
+        # {address bytes: (padded type tag bytes, Struct)} for addresses whose arguments are all fixed size
+        self.formats = {}
+        for addr in flavor.EVENTS:
+            try:
+                tags = [TYPE_TAGS[t] for t in addr.addr_args]
+            except KeyError:
+                continue
+            tag = (',' + ''.join(t for t, _ in tags)).encode('ascii')
+            tag += b'\0' * (_pad(len(tag)) - len(tag))
+            self.formats[addr.address.encode('utf-8')] = (tag, struct.Struct('>' + ''.join(f for _, f in tags)))
+
+    def decode(self, data, out=None, depth=0):
+        # Appends the messages in a packet (which may be a bundle) to out and returns it
+        if out is None:
+            out = []
+        try:
+            if data.startswith(_BUNDLE):
+                if depth < MAX_BUNDLE_DEPTH:
+                    self._decode_bundle(data, out, depth)
+            else:
+                out.append(self._decode_message(data))
+        except (ValueError, IndexError, struct.error):
+            # Malformed packet - keep whatever was decoded before it
+            pass
+        return out
+
+    def _decode_bundle(self, data, out, depth):
+        # Skip the header and time tag, elements are run immediately regardless of the time tag
+        offset = 16
+        while offset < len(data):
+            size = _INT32.unpack_from(data, offset)[0]
+            offset += 4
+            if size < 0 or offset + size > len(data):
+                # Malformed or truncated - a negative size would never move offset forward
+                break
+            self.decode(data[offset:offset + size], out, depth + 1)
+            offset += size
+
+    def _decode_message(self, data):
+        end = data.index(b'\0')
+        address = data[:end]
+        offset = _pad(end)
+
+        compiled = self.formats.get(address)
+        if compiled:
+            tag, fmt = compiled
+            if data.startswith(tag, offset):
+                return address.decode('utf-8'), fmt.unpack_from(data, offset + len(tag))
+
+        return address.decode('utf-8', 'replace'), self._decode_args(data, offset)
+
+    def _decode_args(self, data, offset):
+        if offset >= len(data) or data[offset:offset + 1] != b',':
+            return ()
+        tags, offset = _read_string(data, offset)
+        args = []
+        for tag in tags[1:]:
+            if tag == 'i':
+                args.append(_INT32.unpack_from(data, offset)[0])
+                offset += 4
+            elif tag == 'f':
+                args.append(struct.unpack_from('>f', data, offset)[0])
+                offset += 4
+            elif tag == 'h':
+                args.append(struct.unpack_from('>q', data, offset)[0])
+                offset += 8
+            elif tag == 'd':
+                args.append(struct.unpack_from('>d', data, offset)[0])
+                offset += 8
+            elif tag == 's':
+                value, offset = _read_string(data, offset)
+                args.append(value)
+            elif tag == 'b':
+                size = _INT32.unpack_from(data, offset)[0]
+                args.append(bytes(data[offset + 4:offset + 4 + size]))
+                offset += 4 + ((size + 3) & ~3)
+            elif tag == 'T':
+                args.append(True)
+            elif tag == 'F':
+                args.append(False)
+            elif tag == 'N':
+                args.append(None)
+            elif tag == 'I':
+                args.append(float('inf'))
+            else:
+                raise ValueError(f"Unsupported OSC type tag: {tag}")
+        return tuple(args)
+
+
+def map_messages(flavor, messages):
+    # Map decoded (address, args) messages to (event, args) for Input.ingest_many, dropping unknown addresses
+    events = []
+    for address, args in messages:
+        event, value = flavor.convert(address, args)
+        if event is not None:
+            events.append((event, value))
+    return events
+
+
+class BatchedOSCInput(Input):
+    """\
+    Receives OSC over UDP, draining every pending datagram on each wakeup and ingesting them under a single lock
+    """
+
+    def __init__(self, osc_flavor, host='0.0.0.0', port=7000, max_batch=1024, *args, **kwargs):
+        self.osc_flavor = osc_flavor
+        self.decoder = OSCDecoder(osc_flavor)
+        self.max_batch = max_batch
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        super().__init__(*args, **kwargs)
+
+    def teardown_thread(self):
+        self.sock.close()
+
+    def run_thread_loop(self):
+        # Wake up periodically so the thread notices when it should stop
+        readable, _, _ = select.select([self.sock], [], [], 0.5)
+        if not readable:
+            return
+
+        messages = []
+        for _ in range(self.max_batch):
+            try:
+                data = self.sock.recv(65535)
+            except BlockingIOError:
+                break
+            self.decoder.decode(data, messages)
+
+        events = map_messages(self.osc_flavor, messages)
+        if events:
+            self.ingest_many(events)
@@ -0,0 +1,271 @@
+"""\
+Recording input events to a binary log and replaying them
+
+The log is a header followed by independent chunks, so it can be appended to and a truncated tail only loses the last
+chunk.  Each chunk is (magic, flags, length) then the payload, optionally zlib compressed.  The payload is a sequence
+of records: an event definition (b'E', id, name) the first time an event appears in the chunk, then values as
+(b'V', time, id, value).
+"""
+
+from queue import Queue
+import struct
+import zlib
+from threading import Lock, Thread
+
+from lib.frame import get_clock
+from lib.inputs import Input, events
+
+
+HEADER = b'PLREC1\n'
+CHUNK = struct.Struct('>4sBI')
+CHUNK_MAGIC = b'CHNK'
+FLAG_ZLIB = 1
+
+_DEFINE = struct.Struct('>cHH')
+_VALUE = struct.Struct('>cdH')
+_F64 = struct.Struct('>d')
+_I64 = struct.Struct('>q')
+_U32 = struct.Struct('>I')
+
+
+def _encode_value(value, out):
+    if value is None:
+        out += b'n'
+    elif value is True or value is False:
+        out += b'T' if value else b'F'
+    elif isinstance(value, float):
+        out += b'f' + _F64.pack(value)
+    elif isinstance(value, int):
+        out += b'i' + _I64.pack(value)
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        out += b's' + _U32.pack(len(data)) + data
+    elif isinstance(value, (bytes, bytearray)):
+        out += b'b' + _U32.pack(len(value)) + value
+    elif isinstance(value, (tuple, list)):
+        out += b't' + _U32.pack(len(value))
+        for v in value:
+            _encode_value(v, out)
+    else:
+        raise ValueError(f"Can't record value of type {type(value)}")
+
+
+def _decode_value(data, offset):
+    code = data[offset:offset + 1]
+    offset += 1
+    if code == b'n':
+        return None, offset
+    if code == b'T':
+        return True, offset
+    if code == b'F':
+        return False, offset
+    if code == b'f':
+        return _F64.unpack_from(data, offset)[0], offset + 8
+    if code == b'i':
+        return _I64.unpack_from(data, offset)[0], offset + 8
+    if code in (b's', b'b'):
+        size = _U32.unpack_from(data, offset)[0]
+        value = bytes(data[offset + 4:offset + 4 + size])
+        return (value.decode('utf-8') if code == b's' else value), offset + 4 + size
+    if code == b't':
+        count = _U32.unpack_from(data, offset)[0]
+        offset += 4
+        out = []
+        for _ in range(count):
+            value, offset = _decode_value(data, offset)
+            out.append(value)
+        return tuple(out), offset
+    raise ValueError(f"Bad value code {code!r} in recording")
+
+
+class Recorder:
+    """\
+    Appends timestamped events to a log file, written in chunks
+
+    record() only appends to an in-memory buffer, full chunks are compressed and written by a writer thread so a slow
+    disk never holds up input threads.
+    """
+
+    def __init__(self, path, compress=True, chunk_size=64 * 1024, clock=None):
+        """\
+        Args:
+        path: Log file, appended to if it exists
+        compress: Compress each chunk with zlib
+        chunk_size: Approximate uncompressed size at which a chunk is written out
+        clock: Clock for timestamps, defaults to the global frame clock
+        """
+
+        self.fp = open(path, 'ab')
+        if self.fp.tell() == 0:
+            self.fp.write(HEADER)
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self.clock = clock or get_clock()
+        self.lock = Lock()
+        self.buffer = bytearray()
+        self.ids = {}
+        # Full chunk payloads waiting to be written, None stops the writer
+        self.chunks = Queue()
+        self.writer = Thread(target=self._run_writer, name='recorder-writer')
+        self.writer.start()
+
+    def record(self, event, value, time=None):
+        if type(event) is int:
+            event = events.get_name(event)
+        with self.lock:
+            event_id = self.ids.get(event)
+            if event_id is None:
+                event_id = self.ids[event] = len(self.ids)
+                name = event.encode('utf-8')
+                self.buffer += _DEFINE.pack(b'E', event_id, len(name)) + name
+            self.buffer += _VALUE.pack(b'V', self.clock() if time is None else time, event_id)
+            _encode_value(value, self.buffer)
+            if len(self.buffer) >= self.chunk_size:
+                self._end_chunk()
+
+    def _end_chunk(self):
+        # Hand the buffer to the writer, called with the lock held
+        if not self.buffer:
+            return
+        self.chunks.put(self.buffer)
+        # Chunks are independent, event IDs start over
+        self.buffer = bytearray()
+        self.ids = {}
+
+    def _run_writer(self):
+        while True:
+            payload = self.chunks.get()
+            if payload is None:
+                return
+            flags = 0
+            if self.compress:
+                payload = zlib.compress(payload, 1)
+                flags |= FLAG_ZLIB
+            self.fp.write(CHUNK.pack(CHUNK_MAGIC, flags, len(payload)) + payload)
+            self.fp.flush()
+
+    def flush(self):
+        # Queue whatever has been recorded so far to be written
+        with self.lock:
+            self._end_chunk()
+
+    def close(self):
+        self.flush()
+        self.chunks.put(None)
+        self.writer.join()
+        self.fp.close()
+
+    def start(self):
+        # Record everything passed to Input.ingest
+        Input.recorders.append(self)
+
+    def stop(self):
+        if self in Input.recorders:
+            Input.recorders.remove(self)
+        self.close()
+
+
+def read_log(path):
+    """\
+    Yields (time, event, value) for every record in a log, stopping quietly at a truncated chunk
+    """
+
+    with open(path, 'rb') as fp:
+        if fp.read(len(HEADER)) != HEADER:
+            raise ValueError(f"{path} is not an input recording")
+        while True:
+            head = fp.read(CHUNK.size)
+            if len(head) < CHUNK.size:
+                return
+            magic, flags, size = CHUNK.unpack(head)
+            if magic != CHUNK_MAGIC:
+                raise ValueError(f"Corrupt chunk in {path}")
+            payload = fp.read(size)
+            if len(payload) < size:
+                return
+            if flags & FLAG_ZLIB:
+                payload = zlib.decompress(payload)
+
+            names = {}
+            offset = 0
+            while offset < len(payload):
+                kind = payload[offset:offset + 1]
+                if kind == b'E':
+                    _, event_id, length = _DEFINE.unpack_from(payload, offset)
+                    offset += _DEFINE.size
+                    names[event_id] = payload[offset:offset + length].decode('utf-8')
+                    offset += length
+                else:
+                    _, time, event_id = _VALUE.unpack_from(payload, offset)
+                    value, offset = _decode_value(payload, offset + _VALUE.size)
+                    yield time, names[event_id], value
+
+
+class ReplayInput(Input):
+    """\
+    Feeds a recording back through Input.ingest
+
+    Runs in its own thread at real time (speed=1), N times faster (speed=N) or as fast as possible (speed=None).
+    For frame-exact replay, create it with start_immediately=False and call feed_until with each frame's time - with
+    a SimulatedClock the whole pipeline then sees exactly the same input on every run.
+    """
+
+    def __init__(self, path, speed=1.0, clock=None, *args, **kwargs):
+        self.path = path
+        self.speed = speed
+        self.clock = clock or get_clock()
+        self.records = read_log(path)
+        self.pending = None
+        self.start_time = None
+        self.first_record_time = None
+        self.finished = False
+        super().__init__(*args, **kwargs)
+
+    def _due(self, record_time, now):
+        if self.first_record_time is None:
+            self.first_record_time = record_time
+        if not self.speed:
+            return True
+        return (record_time - self.first_record_time) / self.speed <= now - self.start_time
+
+    def feed_until(self, now, limit=None):
+        """\
+        Ingest every recorded event due at the given clock time, at most limit events
+
+        Returns the number of events fed, the recording is done when self.finished is set
+        """
+
+        if self.start_time is None:
+            self.start_time = now
+        events = []
+        while limit is None or len(events) < limit:
+            if self.pending is None:
+                self.pending = next(self.records, None)
+                if self.pending is None:
+                    self.finished = True
+                    break
+            record_time, event, value = self.pending
+            if not self._due(record_time, now):
+                break
+            events.append((event, value))
+            self.pending = None
+        if events:
+            self.ingest_many(events)
+        return len(events)
+
+    def next_delay(self, now):
+        # Seconds until the next event is due
+        if self.pending is None or not self.speed or self.start_time is None:
+            return 0
+        return max(0, ((self.pending[0] - self.first_record_time) / self.speed) - (now - self.start_time))
+
+    def run_thread_loop(self):
+        # Without a speed, events are fed one at a time so consumers still see them in order
+        self.feed_until(self.clock(), limit=None if self.speed else 1)
+        if self.finished:
+            self.stop_thread.set()
+            return
+        # Wake at least every 100ms so stopping stays responsive
+        delay = min(0.1, self.next_delay(self.clock()))
+        if delay > 0:
+            self.stop_thread.wait(delay)
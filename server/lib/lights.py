@@ -1,8 +1,44 @@
+from bisect import bisect_left
 from threading import RLock
 
 from . import Named, Collected, Grouped
 
 
+class MappingIndex:
+    """\
+    Lookup structures for a single {name: (low, high)} mapping
+
+    The ranges are split at every boundary into points and the open gaps between them, each resolved once to the
+    first matching name in mapping order, so overlapping ranges give the same result as a linear scan.
+    """
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.keys = list(mapping.keys())
+        self.positions = {k: i for i, k in enumerate(self.keys)}
+        self.points = sorted({v for low, high in mapping.values() for v in (low, high)})
+        self.point_keys = [self._scan(p) for p in self.points]
+        self.gap_keys = [self._scan((a + b) / 2) for a, b in zip(self.points, self.points[1:])]
+
+    def _scan(self, value):
+        for key, (low, high) in self.mapping.items():
+            if value >= low and value <= high:
+                return key
+        return None
+
+    def find(self, value):
+        # The name of the range containing value, or None
+        i = bisect_left(self.points, value)
+        if i < len(self.points) and self.points[i] == value:
+            return self.point_keys[i]
+        if 0 < i < len(self.points):
+            return self.gap_keys[i - 1]
+        return None
+
+
+EMPTY_MAPPING_INDEX = MappingIndex({})
+
+
 class LightTypeFunction(Named):
     def __init__(self, *args, invert=False, reset=None, mapping=None, meta=None, **kwargs):
         super().__init__(*args, **kwargs)
@@ -11,21 +47,31 @@ class LightTypeFunction(Named):
         self.mapping = mapping or {}
         self.meta = dict(meta or {})
         self.mapping_order = 0
+        self._mapping_index = None
+
+    def get_mapping_index(self, light, mapped_state=None):
+        # mapped_state may be passed by callers that already hold the light's state lock, to avoid copying it
+        if self._mapping_index is None:
+            if isinstance(self.mapping, list):
+                self._mapping_index = [(cond, MappingIndex(mapping)) for cond, mapping in self.mapping]
+            else:
+                self._mapping_index = MappingIndex(self.mapping)
 
-    def get_mapping(self, light):
-        if isinstance(self.mapping, list):
-            mapped_state = light.get_mapped_state()
-            for (cond_key, cond_value), mapping in self.mapping:
+        if isinstance(self._mapping_index, list):
+            if mapped_state is None:
+                mapped_state = light.get_mapped_state()
+            for (cond_key, cond_value), index in self._mapping_index:
                 if mapped_state.get(cond_key) == cond_value:
-                    return mapping
-            return {}
-        return self.mapping
+                    return index
+            return EMPTY_MAPPING_INDEX
+        return self._mapping_index
+
+    def get_mapping(self, light, mapped_state=None):
+        return self.get_mapping_index(light, mapped_state).mapping
 
     def _get_mapping_idx(self, light, value):
-        mappings = list(self.get_mapping(light).keys())
-        if value in mappings:
-            return mappings, mappings.index(value)
-        return mappings, None
+        index = self.get_mapping_index(light)
+        return index.keys, index.positions.get(value)
 
     def next_mapping_from(self, light, value, wrap=True):
         mappings, idx = self._get_mapping_idx(light, value)
@@ -47,10 +93,10 @@ class LightTypeFunction(Named):
             return mappings[idx - 1]
         return None
 
-    def convert_to_raw(self, light, value):
+    def convert_to_raw(self, light, value, mapped_state=None):
         # Accepts a float/string for mapping
         if isinstance(value, str):
-            mapping = self.get_mapping(light)
+            mapping = self.get_mapping(light, mapped_state)
             if value in mapping:
                 out = self.convert_from_output(light, mapping[value][0])
             else:
@@ -60,15 +106,14 @@ class LightTypeFunction(Named):
             out = value
         return out
 
-    def convert_to_mapped(self, light, value):
+    def convert_to_mapped(self, light, value, mapped_state=None):
         # Convert a raw value to a mapping if present, otherwise return raw value
         # mapping is by output value - convert first
         outvalue = self.convert_to_output(light, value)
-        mapping = self.get_mapping(light)
-        for key, (low, high) in mapping.items():
-            if outvalue >= low and outvalue <= high:
-                return key
-        return value
+        key = self.get_mapping_index(light, mapped_state).find(outvalue)
+        if key is None:
+            return value
+        return key
 
     def convert_to_output(self, light, value):
         # Convert a raw value to the output value
@@ -131,16 +176,106 @@ class DMXLightTypeFunction(LightTypeFunction):
         return super().convert_from_output(light, value / 255.0)
 
 
+class ConversionPlan:
+    """\
+    A light type's functions compiled into a flat list of steps for Light.update_state
+
+    Functions of the plain LightTypeFunction/DMXLightTypeFunction types have their conversions inlined here, anything
+    else (including map_multi, which depends on other functions) calls the function's own methods.  Must give the same
+    results as calling convert_to_raw, convert_to_mapped and convert_to_output for each function in mapping order.
+    """
+
+    # Output conversion kinds
+    GENERIC = 0
+    PLAIN = 1
+    DMX = 2
+    HIGHRES = 3
+
+    def __init__(self, light_type):
+        self.steps = []
+        for fn in sorted(light_type.functions.values(), key=lambda f: f.mapping_order):
+            kind = self.GENERIC
+            highres = None
+            if type(fn) is LightTypeFunction:
+                kind = self.PLAIN
+            elif type(fn) is DMXLightTypeFunction and not fn.map_multi:
+                if fn.map_highres:
+                    kind = self.HIGHRES
+                    # (key, shift) for each byte, most significant first
+                    n = len(fn.map_highres)
+                    highres = ((1 << (8 * n)) - 1, [(key, 8 * (n - 1 - i)) for i, key in enumerate(fn.map_highres)])
+                else:
+                    kind = self.DMX
+            self.steps.append((fn.name, fn, kind, bool(fn.invert), bool(fn.mapping), highres))
+
+        # (output state key, channel index) for DMX functions with a channel
+        self.dmx_channels = [
+            (f.name, f.channel - 1)
+            for f in light_type.functions.values()
+            if getattr(f, 'channel', None) is not None
+        ]
+
+    def run(self, light, new_state):
+        # Must be called with the light's state lock held
+        raw_state = light.raw_state
+        mapped_state = light.mapped_state
+        output_state = light.output_state
+        for name, fn, kind, invert, has_mapping, highres in self.steps:
+            if name in new_state:
+                value = new_state[name]
+                raw_state[name] = fn.convert_to_raw(light, value, mapped_state) if isinstance(value, str) else value
+            raw = raw_state[name]
+
+            if has_mapping:
+                res = fn.convert_to_mapped(light, raw, mapped_state)
+                if isinstance(res, dict):
+                    mapped_state.update(res)
+                else:
+                    mapped_state[name] = res
+            else:
+                mapped_state[name] = raw
+
+            if kind == self.GENERIC:
+                res = fn.convert_to_output(light, raw)
+                if isinstance(res, dict):
+                    output_state.update(res)
+                else:
+                    output_state[name] = res
+                continue
+
+            value = 1 - raw if invert else raw
+            if kind == self.DMX:
+                output_state[name] = int(value * 255)
+            elif kind == self.HIGHRES:
+                maxval, keys = highres
+                intval = int(maxval * value)
+                for key, shift in keys:
+                    output_state[key] = (intval >> shift) & 0xff
+            else:
+                output_state[name] = value
+
+
 class LightType(Named, Collected()):
     PROTOCOL = None
 
     def __init__(self, name, functions, *args, **kwargs):
         super().__init__(name, *args, **kwargs)
         self.functions = {f.name: f for f in functions or []}
+        self._plan = None
 
     def _get_functions_for_mapping(self):
         return list(sorted(self.functions.values(), key=lambda f: f.mapping_order))
 
+    @property
+    def plan(self):
+        # Compiled on first use, call invalidate_plan after changing functions
+        if self._plan is None:
+            self._plan = ConversionPlan(self)
+        return self._plan
+
+    def invalidate_plan(self):
+        self._plan = None
+
 
 class DMXLightType(LightType):
     PROTOCOL = 'dmx'
@@ -162,21 +297,7 @@ class Light(Named, Grouped, Collected()):
 
     def update_state(self, new_state):
         with self.state_lock:
-            for fn in self.type._get_functions_for_mapping():
-                if fn.name in new_state:
-                    self.raw_state[fn.name] = fn.convert_to_raw(self, new_state[fn.name])
-
-                res = fn.convert_to_mapped(self, self.raw_state[fn.name])
-                if isinstance(res, dict):
-                    self.mapped_state.update(res)
-                else:
-                    self.mapped_state[fn.name] = res
-
-                res = fn.convert_to_output(self, self.raw_state[fn.name])
-                if isinstance(res, dict):
-                    self.output_state.update(res)
-                else:
-                    self.output_state[fn.name] = res
+            self.type.plan.run(self, new_state)
 
     def get_raw_state(self, key=None, dfl=None):
         with self.state_lock:
@@ -194,9 +315,11 @@ class Light(Named, Grouped, Collected()):
 
 
 class DMXLight(Light):
-    def __init__(self, name, channel, type, *args, **kwargs):
+    def __init__(self, name, channel, type, *args, universe=0, **kwargs):
         super().__init__(name, type, *args, **kwargs)
         self.channel = channel
+        # Only used by outputs that can drive more than one universe
+        self.universe = universe
 
     def get_dmx_state(self, speed_only=False):
         state = self.get_output_state()
@@ -207,3 +330,12 @@ class DMXLight(Light):
                 if fn.channel is not None:
                     out[self.channel + (fn.channel - 1)] = v
         return out
+
+    def get_dmx_block(self):
+        # All of this light's channels as bytes, starting at self.channel
+        out = bytearray(self.type.channels)
+        with self.state_lock:
+            for k, i in self.type.plan.dmx_channels:
+                if 0 <= i < len(out):
+                    out[i] = max(0, min(255, int(self.output_state[k])))
+        return out
@@ -0,0 +1,239 @@
+"""\
+Counters, gauges and latency histograms
+
+Counters and histograms are kept per thread, so recording never takes a lock - snapshot() merges every thread's
+values.  Counters only ever increase, rates come from the difference between two snapshots.  Histograms bucket
+latencies HDR-style: linear below 64us, then 32 sub-buckets per power of two (about 3% precision) up to ~71 minutes.
+"""
+
+from array import array
+import threading
+import time
+
+from . import HasThread
+
+
+class Histogram:
+    SUB_BITS = 5
+    SUB_BUCKETS = 1 << SUB_BITS
+    # Largest recordable value in microseconds, larger values are clamped
+    MAX_VALUE = (1 << 32) - 1
+
+    def __init__(self):
+        self.counts = array('q', bytes(8 * (self._index(self.MAX_VALUE) + 1)))
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def _index(cls, value):
+        if value < 2 * cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - cls.SUB_BITS - 1
+        return ((shift + 1) << cls.SUB_BITS) + (value >> shift) - cls.SUB_BUCKETS
+
+    @classmethod
+    def _value(cls, index):
+        # Upper bound of a bucket, in microseconds
+        if index < 2 * cls.SUB_BUCKETS:
+            return index
+        shift = (index >> cls.SUB_BITS) - 1
+        return (((index & (cls.SUB_BUCKETS - 1)) + cls.SUB_BUCKETS + 1) << shift) - 1
+
+    def record(self, seconds):
+        value = min(self.MAX_VALUE, max(0, int(seconds * 1e6)))
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        counts = self.counts
+        for i, n in enumerate(other.counts):
+            if n:
+                counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def since(self, earlier):
+        # Histogram of the values recorded after an earlier copy of this one was taken
+        out = Histogram()
+        out.counts = array('q', (a - b for a, b in zip(self.counts, earlier.counts)))
+        out.count = self.count - earlier.count
+        out.total = self.total - earlier.total
+        top = max((i for i, n in enumerate(out.counts) if n), default=None)
+        out.max = 0 if top is None else min(self._value(top), self.max)
+        return out
+
+    def percentile(self, p):
+        # Value at percentile p (0-100) in seconds, accurate to the bucket size
+        if not self.count:
+            return None
+        target = max(1, self.count * p / 100.0)
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return min(self._value(i), self.max) / 1e6
+        return self.max / 1e6
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': self.total / self.count / 1e6,
+            'max': self.max / 1e6,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+        }
+
+
+class _ThreadMetrics:
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+_local = threading.local()
+_threads = []
+_threads_lock = threading.Lock()
+gauges = {}
+gauge_functions = {}
+
+
+def _mine():
+    try:
+        return _local.metrics
+    except AttributeError:
+        metrics = _local.metrics = _ThreadMetrics()
+        with _threads_lock:
+            _threads.append(metrics)
+        return metrics
+
+
+def count(name, n=1):
+    counters = _mine().counters
+    counters[name] = counters.get(name, 0) + n
+
+
+def observe(name, seconds):
+    histograms = _mine().histograms
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram()
+    histogram.record(seconds)
+
+
+def set_gauge(name, value):
+    gauges[name] = value
+
+
+def register_gauge(name, function):
+    # function is called for the gauge's value on each snapshot, e.g. a queue's length
+    gauge_functions[name] = function
+
+
+class Timer:
+    """\
+    Context manager recording the time spent in its block to a histogram
+    """
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+
+
+def get_counters():
+    with _threads_lock:
+        threads = list(_threads)
+    out = {}
+    for metrics in threads:
+        # Copying a dict is atomic, the owning thread may be adding to it
+        for name, n in metrics.counters.copy().items():
+            out[name] = out.get(name, 0) + n
+    return out
+
+
+def get_histograms():
+    with _threads_lock:
+        threads = list(_threads)
+    out = {}
+    for metrics in threads:
+        for name, histogram in metrics.histograms.copy().items():
+            merged = out.get(name)
+            if merged is None:
+                merged = out[name] = Histogram()
+            merged.merge(histogram)
+    return out
+
+
+def get_gauges():
+    out = dict(gauges)
+    for name, function in list(gauge_functions.items()):
+        try:
+            out[name] = function()
+        except Exception:
+            out[name] = None
+    return out
+
+
+def snapshot():
+    """\
+    Current metrics as {'time', 'counters', 'gauges', 'histograms'}, histograms summarized as count, mean, max and
+    percentiles in seconds
+    """
+
+    return {
+        'time': time.time(),
+        'counters': get_counters(),
+        'gauges': get_gauges(),
+        'histograms': {name: h.summary() for name, h in get_histograms().items()},
+    }
+
+
+_last_report = None
+
+
+def report():
+    # Print counter rates and latencies since the last report, called once per second
+    global _last_report
+    current = (time.time(), get_counters(), get_histograms())
+    last, _last_report = _last_report, current
+    if last is None:
+        return
+    elapsed = (current[0] - last[0]) or 1
+    parts = []
+    for name, n in sorted(current[1].items()):
+        rate = (n - last[1].get(name, 0)) / elapsed
+        if rate:
+            parts.append(f'{name}: {rate:.0f}/s')
+    for name, h in sorted(current[2].items()):
+        if name in last[2]:
+            h = h.since(last[2][name])
+        if h.count:
+            parts.append(f"{name}: p50 {h.percentile(50) * 1000:.2f}ms p99 {h.percentile(99) * 1000:.2f}ms")
+    if parts:
+        print("Metrics:", ', '.join(parts))
+
+
+class MetricsThread(HasThread):
+    def run_thread_loop(self):
+        time.sleep(1)
+        report()
+
+MetricsThread()
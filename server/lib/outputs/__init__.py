@@ -1,25 +1,96 @@
 from queue import Queue, Empty
+from threading import Condition
 
-from lib import HasThread, Named, Collected, fps
+from lib import HasThread, Named, Collected, metrics
+
+
+class Mailbox:
+    """\
+    Holds only the latest item - putting an item replaces (or, with merge, combines with) one that wasn't taken yet
+
+    Has the same put/get interface as Queue, so the consumer never falls behind the producer by more than one item.
+    """
+
+    def __init__(self, merge=None):
+        """\
+        Args:
+        merge: Optional function accepting (pending, new) and returning the item to keep, instead of dropping pending
+        """
+
+        self.merge = merge
+        self.cond = Condition()
+        self.item = None
+        self.has_item = False
+        self.dropped = 0
+        self.coalesced = 0
+
+    def put(self, item):
+        # Returns True if an item that wasn't taken yet was dropped or merged
+        with self.cond:
+            replaced = self.has_item
+            if replaced:
+                if self.merge:
+                    item = self.merge(self.item, item)
+                    self.coalesced += 1
+                else:
+                    self.dropped += 1
+            self.item = item
+            self.has_item = True
+            self.cond.notify()
+        return replaced
+
+    def qsize(self):
+        return int(self.has_item)
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.has_item, timeout=timeout):
+                raise Empty()
+            item = self.item
+            self.item = None
+            self.has_item = False
+            return item
+
+
+def merge_lights(pending, new):
+    # Lights are output from their current state, so a light modified in either frame only needs to appear once
+    names = {l.name for l in new}
+    return [l for l in pending if l.name not in names] + list(new)
 
 
 class Output(Named, Collected(), HasThread):
     all_outputs = []
+    # Seconds without a frame after which idle() is called
+    idle_interval = 1
 
-    def __init__(self, *args, **kwargs):
-        self.queue = Queue()
+    def __init__(self, *args, lossless=False, **kwargs):
+        # Outputs normally only care about the newest frame, lossless outputs (e.g. recording) get every frame
+        self.lossless = lossless
+        self.queue = Queue() if lossless else Mailbox(merge=merge_lights)
         super().__init__(*args, **kwargs)
         self.all_outputs.append(self)
+        metrics.register_gauge(f'output.{self.name}.queue', self.queue.qsize)
 
     def run_thread_loop(self):
         try:
-            self.process_lights(self.queue.get(timeout=1))
+            self.process_lights(self.queue.get(timeout=self.idle_interval))
         except Empty:
-            pass
+            self.idle()
 
     def process_lights(self, lights):
         pass
 
+    def idle(self):
+        # Called when no lights changed for idle_interval, e.g. to refresh outputs that need periodic keepalives
+        pass
+
+    def close(self):
+        # Called once when the output stops, by whichever runtime drives it, e.g. to close sockets
+        pass
+
+    def teardown_thread(self):
+        self.close()
+
     @classmethod
     def run_all(cls, output, lights):
         modified = []
@@ -30,4 +101,5 @@ class Output(Named, Collected(), HasThread):
 
         if modified:
             for o in cls.all_outputs:
-                o.queue.put(modified)
+                if o.queue.put(modified):
+                    metrics.count(f'output.{o.name}.coalesced')
@@ -0,0 +1,52 @@
+"""\
+Art-Net (ArtDMX) output
+"""
+
+import struct
+
+from .dmx import UNIVERSE_SIZE
+from .network import NetworkDMXOutput, UniverseBuffer
+
+
+ARTNET_PORT = 6454
+ARTNET_ID = b'Art-Net\0'
+OP_DMX = 0x5000
+PROTOCOL_VERSION = 14
+# Offset of the sequence number in an ArtDMX packet
+_SEQUENCE_OFFSET = 12
+
+
+class ArtNetOutput(NetworkDMXOutput):
+    """\
+    Sends each universe as ArtDMX packets, broadcast unless nodes are given
+
+    Universes are 15-bit Art-Net port addresses (net, subnet and universe), light.universe 0 is port address 0.
+    """
+
+    PORT = ARTNET_PORT
+
+    def __init__(self, *args, broadcast='255.255.255.255', physical=0, **kwargs):
+        """\
+        Args:
+        broadcast: Broadcast address for universes without nodes, usually the Art-Net network's (e.g. 2.255.255.255)
+        physical: Physical input port reported in packets
+        """
+
+        self.broadcast = broadcast
+        self.physical = physical
+        super().__init__(*args, **kwargs)
+
+    def create_universe(self, number):
+        if not 0 <= number < 0x8000:
+            raise ValueError(f"Invalid Art-Net universe: {number}")
+        header = ARTNET_ID + struct.pack('<H', OP_DMX) + struct.pack('>HBB', PROTOCOL_VERSION, 0, self.physical)
+        header += struct.pack('<H', number) + struct.pack('>H', UNIVERSE_SIZE)
+        return UniverseBuffer(number, header)
+
+    def prepare(self, universe):
+        # Sequence numbers run 1-255, 0 would disable reordering on the receiver
+        universe.sequence = (universe.sequence % 255) + 1
+        universe.packet[_SEQUENCE_OFFSET] = universe.sequence
+
+    def default_targets(self, number):
+        return [self.broadcast]
@@ -7,7 +7,15 @@ import re
 from dmxpy.DmxPy import DmxPy
 
 from . import Output
-from lib import fps
+from lib import metrics
+
+
+UNIVERSE_SIZE = 512
+
+# Enttec USB Pro "output only send DMX" packet: start of message, label, data length (start code + universe, LSB
+# first), then the DMX start code, channel data, and end of message
+_PACKET_HEADER = bytes([0x7e, 0x06, (UNIVERSE_SIZE + 1) & 0xff, (UNIVERSE_SIZE + 1) >> 8, 0x00])
+_PACKET_FOOTER = bytes([0xe7])
 
 
 class DMXDevice:
@@ -22,7 +30,12 @@ class DMXDevice:
         self.debug = debug
         self.last_find = None
         self.dmx = None
-        self.data = {i + 1: 0 for i in range(512)}
+
+        # The universe lives inside a complete output packet so a render is a single write with no copying
+        self.packet = bytearray(_PACKET_HEADER + bytes(UNIVERSE_SIZE) + _PACKET_FOOTER)
+        self.universe = memoryview(self.packet)[len(_PACKET_HEADER):len(_PACKET_HEADER) + UNIVERSE_SIZE]
+        # Dirty channels since the last render, as a half-open range of universe indexes, None when clean
+        self.dirty = None
 
         self.find_device()
 
@@ -34,6 +47,8 @@ class DMXDevice:
                 if devfile:
                     try:
                         self.dmx = DmxPy(devfile)
+                        # A new device has none of our data yet
+                        self.mark_dirty(0, UNIVERSE_SIZE)
                     except:
                         print("Can't open dmx device file:", devfile)
             except:
@@ -119,40 +134,75 @@ class DMXDevice:
 
         raise RuntimeError(f"Can't find USB device {name}")
 
+    @staticmethod
+    def _clamp(value):
+        return max(0, min(255, int(value)))
+
+    def mark_dirty(self, start, end):
+        if self.dirty is None:
+            self.dirty = (start, end)
+        else:
+            self.dirty = (min(start, self.dirty[0]), max(end, self.dirty[1]))
+
     def update(self, data):
-        self.data.update(data)
+        for chan, value in data.items():
+            self.set_channel(chan, value)
 
     def set_channel(self, chan, value):
-        self.data[chan] = value
+        value = self._clamp(value)
+        if self.universe[chan - 1] != value:
+            self.universe[chan - 1] = value
+            self.mark_dirty(chan - 1, chan)
+
+    def set_block(self, chan, values):
+        # Set consecutive channels starting at chan from a bytes-like object
+        start = chan - 1
+        end = min(UNIVERSE_SIZE, start + len(values))
+        if start < 0 or start >= end:
+            return
+        values = memoryview(values)[:end - start]
+        if self.universe[start:end] != values:
+            self.universe[start:end] = values
+            self.mark_dirty(start, end)
 
     def render(self):
-        if self.data:
-            self.find_device()
-            if self.debug is True or (self.debug is None and not self.dmx):
-                print("DMX OUT:", self.data)
-            if self.dmx:
-                for k, v in self.data.items():
-                    self.dmx.set_channel(k, v)
+        # Only send when something changed, the interface keeps repeating the last universe it received
+        self.find_device()
+        if self.dirty is None:
+            return False
+
+        if self.debug is True or (self.debug is None and not self.dmx):
+            start, end = self.dirty
+            print("DMX OUT:", {i + 1: self.universe[i] for i in range(start, end)})
+        if self.dmx:
+            serial = getattr(self.dmx, 'serial', None)
+            if serial is not None:
+                serial.write(self.packet)
+            else:
+                start, end = self.dirty
+                for i in range(start, end):
+                    self.dmx.set_channel(i + 1, self.universe[i])
                 self.dmx.render()
-                self.data = {}
+            self.dirty = None
+        return True
 
 
 class DMXOutput(Output):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, universe=0, **kwargs):
+        # A USB interface drives a single universe, lights in other universes are ignored
+        self.universe = universe
         # TODO: configurable
         self.dmx = DMXDevice()
-        self.last_render = None
-        self.render_s = 1 / 70.0  # TODO: configure fps
         super().__init__(*args, **kwargs)
 
     def process_lights(self, lights):
-        fps.count('DMXProcess')
-        now = time.time()
+        # Frames are paced by the FrameScheduler (and conflated by the mailbox if this falls behind), so every frame
+        # received is rendered
+        metrics.count('dmx.process')
 
         for l in lights:
-            if l.type.PROTOCOL == 'dmx':
-                self.dmx.update(l.get_dmx_state())
-        if self.last_render is None or now - self.last_render >= self.render_s:
-            self.last_render = now
-            self.dmx.render()
-            fps.count('DMX')
+            if l.type.PROTOCOL == 'dmx' and l.universe == self.universe:
+                self.dmx.set_block(l.channel, l.get_dmx_block())
+        with metrics.Timer('dmx.render'):
+            rendered = self.dmx.render()
+        metrics.count('dmx.sent' if rendered else 'dmx.unchanged')
@@ -0,0 +1,120 @@
+"""\
+Base for DMX over UDP outputs (Art-Net, sACN) driving any number of universes
+
+Each universe's channels live inside a preallocated packet, so sending is a header update and a sendto with no
+copying.  A universe is sent when any of its channels changed and otherwise refreshed every refresh seconds, which
+receivers need to keep their output alive.
+"""
+
+import socket
+import time
+
+from lib import metrics
+from . import Output
+from .dmx import UNIVERSE_SIZE
+
+
+class UniverseBuffer:
+    def __init__(self, number, header, footer=b''):
+        self.number = number
+        self.packet = bytearray(header + bytes(UNIVERSE_SIZE) + footer)
+        self.data = memoryview(self.packet)[len(header):len(header) + UNIVERSE_SIZE]
+        # Send a new universe straight away
+        self.dirty = True
+        self.last_sent = None
+        self.sequence = 0
+
+    def set_block(self, chan, values):
+        # Set consecutive channels starting at chan (1-based) from a bytes-like object
+        start = chan - 1
+        end = min(UNIVERSE_SIZE, start + len(values))
+        if start < 0 or start >= end:
+            return
+        values = memoryview(values)[:end - start]
+        if self.data[start:end] != values:
+            self.data[start:end] = values
+            self.dirty = True
+
+
+class NetworkDMXOutput(Output):
+    PORT = None
+
+    def __init__(self, *args, nodes=None, universes=(), refresh=1.0, **kwargs):
+        """\
+        Args:
+        nodes: Addresses to unicast to - a list for every universe, or {universe: [addresses]}.  Universes without
+            nodes are broadcast (or multicast, depending on the protocol)
+        universes: Universes to create up front, others are created when a light in them is first seen
+        refresh: Seconds after which an unchanged universe is sent again
+        """
+
+        self.nodes = nodes
+        self.refresh = refresh
+        self.idle_interval = refresh
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.universes = {}
+        for number in universes:
+            self.get_universe(number)
+        super().__init__(*args, **kwargs)
+
+    def create_universe(self, number):
+        raise NotImplementedError()
+
+    def prepare(self, universe):
+        # Update the packet header before it's sent, e.g. the sequence number
+        pass
+
+    def default_targets(self, number):
+        raise NotImplementedError()
+
+    def finish_send(self, universes):
+        # Called after universes were sent, e.g. to send a sync packet
+        pass
+
+    def get_universe(self, number):
+        universe = self.universes.get(number)
+        if universe is None:
+            universe = self.universes[number] = self.create_universe(number)
+        return universe
+
+    def targets(self, number):
+        if self.nodes is None:
+            return self.default_targets(number)
+        if isinstance(self.nodes, dict):
+            return self.nodes.get(number) or self.default_targets(number)
+        return self.nodes
+
+    def process_lights(self, lights):
+        for l in lights:
+            if l.type.PROTOCOL == 'dmx':
+                self.get_universe(l.universe).set_block(l.channel, l.get_dmx_block())
+        self.send()
+
+    def send(self):
+        now = time.monotonic()
+        sent = []
+        for universe in self.universes.values():
+            if universe.dirty:
+                metrics.count(f'{self.name}.sent')
+            elif universe.last_sent is None or now - universe.last_sent >= self.refresh:
+                metrics.count(f'{self.name}.refresh')
+            else:
+                continue
+            self.prepare(universe)
+            for address in self.targets(universe.number):
+                try:
+                    self.sock.sendto(universe.packet, (address, self.PORT))
+                except OSError:
+                    metrics.count(f'{self.name}.errors')
+            universe.dirty = False
+            universe.last_sent = now
+            sent.append(universe)
+        if sent:
+            self.finish_send(sent)
+
+    def idle(self):
+        self.send()
+
+    def close(self):
+        self.sock.close()
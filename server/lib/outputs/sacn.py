@@ -0,0 +1,136 @@
+"""\
+Streaming ACN (E1.31) output
+"""
+
+import struct
+import uuid
+
+from lib import metrics
+from .dmx import UNIVERSE_SIZE
+from .network import NetworkDMXOutput, UniverseBuffer
+
+
+SACN_PORT = 5568
+ACN_PACKET_IDENTIFIER = b'ASC-E1.17\0\0\0'
+VECTOR_ROOT_E131_DATA = 0x00000004
+VECTOR_ROOT_E131_EXTENDED = 0x00000008
+VECTOR_E131_DATA_PACKET = 0x00000002
+VECTOR_E131_EXTENDED_SYNCHRONIZATION = 0x00000001
+VECTOR_DMP_SET_PROPERTY = 0x02
+MAX_UNIVERSE = 63999
+OPTION_STREAM_TERMINATED = 0x40
+
+# Offsets into a data packet of the fields rewritten while streaming
+_PRIORITY_OFFSET = 108
+_SEQUENCE_OFFSET = 111
+_OPTIONS_OFFSET = 112
+# Offset of the sequence number in a sync packet
+_SYNC_SEQUENCE_OFFSET = 44
+
+
+def _flags_length(length):
+    return struct.pack('>H', 0x7000 | length)
+
+
+def multicast_address(universe):
+    return '239.255.{}.{}'.format(universe >> 8, universe & 0xff)
+
+
+def _root_layer(vector, cid, length):
+    # length is the whole packet, the root layer's own length field counts from after the preamble
+    return struct.pack('>HH', 0x0010, 0x0000) + ACN_PACKET_IDENTIFIER + _flags_length(length - 16) + struct.pack('>I', vector) + cid
+
+
+def data_header(universe, cid, source_name, priority=100, sync_universe=0):
+    # Everything in a data packet before the DMX slots, starting with the DMX start code
+    length = 126 + UNIVERSE_SIZE
+    name = source_name.encode('utf-8')[:63].ljust(64, b'\0')
+    framing = _flags_length(length - 38) + struct.pack('>I', VECTOR_E131_DATA_PACKET) + name
+    framing += struct.pack('>BHBBH', priority, sync_universe, 0, 0, universe)
+    dmp = _flags_length(length - 115) + struct.pack('>BBHHH', VECTOR_DMP_SET_PROPERTY, 0xa1, 0x0000, 0x0001, UNIVERSE_SIZE + 1)
+    return _root_layer(VECTOR_ROOT_E131_DATA, cid, length) + framing + dmp + b'\0'
+
+
+def sync_packet(sync_universe, cid):
+    length = 49
+    framing = _flags_length(length - 38) + struct.pack('>IBHH', VECTOR_E131_EXTENDED_SYNCHRONIZATION, 0, sync_universe, 0)
+    return bytearray(_root_layer(VECTOR_ROOT_E131_EXTENDED, cid, length) + framing)
+
+
+class SACNOutput(NetworkDMXOutput):
+    """\
+    Sends each universe as E1.31 data packets, multicast unless nodes are given
+
+    sACN universes start at 1, light.universe + universe_offset is the universe sent on the wire.  With a
+    sync_universe, receivers hold each universe's data until the sync packet sent after every batch, so all the
+    universes of a frame change together.
+    """
+
+    PORT = SACN_PORT
+
+    def __init__(self, *args, priority=100, priorities=None, sync_universe=None, universe_offset=1, source_name='partylights', cid=None, **kwargs):
+        """\
+        Args:
+        priority: Default priority (0-200) for every universe
+        priorities: {universe: priority} overriding the default for some universes, keyed by light.universe
+        sync_universe: Universe to send sync packets on, None to not synchronize
+        universe_offset: Added to light.universe to get the sACN universe
+        source_name: Name shown by receivers
+        cid: 16 byte component ID, random by default - should be kept constant if receivers track sources
+        """
+
+        self.priority = priority
+        self.priorities = priorities or {}
+        self.sync_universe = sync_universe
+        self.universe_offset = universe_offset
+        self.source_name = source_name
+        self.cid = cid or uuid.uuid4().bytes
+        self.sync = sync_packet(sync_universe, self.cid) if sync_universe else None
+        self.sync_sequence = 0
+        super().__init__(*args, **kwargs)
+
+    def create_universe(self, number):
+        wire = number + self.universe_offset
+        if not 1 <= wire <= MAX_UNIVERSE:
+            raise ValueError(f"Invalid sACN universe: {wire}")
+        priority = self.priorities.get(number, self.priority)
+        if not 0 <= priority <= 200:
+            raise ValueError(f"Invalid sACN priority: {priority}")
+        return UniverseBuffer(number, data_header(wire, self.cid, self.source_name, priority, self.sync_universe or 0))
+
+    def prepare(self, universe):
+        universe.sequence = (universe.sequence + 1) & 0xff
+        universe.packet[_SEQUENCE_OFFSET] = universe.sequence
+
+    def default_targets(self, number):
+        return [multicast_address(number + self.universe_offset)]
+
+    def finish_send(self, universes):
+        if not self.sync:
+            return
+        self.sync_sequence = (self.sync_sequence + 1) & 0xff
+        self.sync[_SYNC_SEQUENCE_OFFSET] = self.sync_sequence
+        # Sync goes wherever the data went
+        targets = set()
+        for universe in universes:
+            targets.update(self.targets(universe.number))
+        if self.nodes is None:
+            targets = {multicast_address(self.sync_universe)}
+        for address in targets:
+            try:
+                self.sock.sendto(self.sync, (address, self.PORT))
+            except OSError:
+                metrics.count(f'{self.name}.errors')
+
+    def close(self):
+        # Tell receivers the stream is ending so they don't hold the last frame until timing out, 3 times per E1.31
+        for universe in self.universes.values():
+            universe.packet[_OPTIONS_OFFSET] |= OPTION_STREAM_TERMINATED
+            for _ in range(3):
+                self.prepare(universe)
+                for address in self.targets(universe.number):
+                    try:
+                        self.sock.sendto(universe.packet, (address, self.PORT))
+                    except OSError:
+                        pass
+        super().close()
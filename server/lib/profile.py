@@ -0,0 +1,147 @@
+"""\
+Opt-in profiling of the frame pipeline
+
+enable() wraps the controller, scenes, programs, effects and Light.update_state to time every call, disable() puts
+the original methods back, so there is no cost at all while profiling is off.  Time is attributed to the stack of
+objects it was spent in, both cumulatively and for each of the last few frames, and can be written out as collapsed
+stacks ("controller;scene:main;program:base;effect:strobe 1234", microseconds of self time) for flamegraph.pl,
+speedscope and similar.
+"""
+
+from collections import deque
+import functools
+import threading
+import time
+
+
+enabled = False
+# {stack: [calls, total seconds, self seconds]} since profiling was enabled or reset
+totals = {}
+# {stack: self seconds} for each recent frame, see end_frame
+frames = deque(maxlen=256)
+_frame = {}
+_local = threading.local()
+_lock = threading.Lock()
+_originals = {}
+
+
+def default_hooks():
+    # (class, method name, function returning the label for an instance)
+    from lib.data import SceneController, Scene, Program, Effect
+    from lib.lights import Light
+
+    return [
+        (SceneController, '__call__', lambda o: 'controller'),
+        (Scene, '__call__', lambda o: 'scene:' + o.name),
+        (Program, '_call__single', lambda o: 'program:' + o.name),
+        (Program, '_call__multi', lambda o: 'program:' + o.name),
+        (Effect, 'for_lights', lambda o: 'effect:' + o.name + ':for_lights'),
+        (Effect, '__call__', lambda o: 'effect:' + o.name),
+        (Light, 'update_state', lambda o: 'light:' + o.name),
+    ]
+
+
+def _record(stack, elapsed, self_time):
+    with _lock:
+        entry = totals.get(stack)
+        if entry is None:
+            entry = totals[stack] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] += self_time
+        _frame[stack] = _frame.get(stack, 0.0) + self_time
+
+
+def _wrap(fn, label):
+    @functools.wraps(fn)
+    def wrapper(obj, *args, **kwargs):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        name = label(obj)
+        # [stack of labels, time spent in children]
+        entry = [stack[-1][0] + (name,) if stack else (name,), 0.0]
+        stack.append(entry)
+        start = time.perf_counter()
+        try:
+            return fn(obj, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            _record(entry[0], elapsed, elapsed - entry[1])
+
+    return wrapper
+
+
+def enable(hooks=None):
+    global enabled
+    if enabled:
+        return
+    for cls, attr, label in (default_hooks() if hooks is None else hooks):
+        original = cls.__dict__[attr]
+        _originals[(cls, attr)] = original
+        setattr(cls, attr, _wrap(original, label))
+    enabled = True
+
+
+def disable():
+    global enabled
+    for (cls, attr), original in _originals.items():
+        setattr(cls, attr, original)
+    _originals.clear()
+    enabled = False
+
+
+def reset():
+    global _frame
+    with _lock:
+        totals.clear()
+        frames.clear()
+        _frame = {}
+
+
+def end_frame():
+    # Called by the render loop after each frame, closes the frame's entry in frames
+    global _frame
+    if not enabled:
+        return
+    with _lock:
+        if _frame:
+            frames.append(_frame)
+            _frame = {}
+
+
+def collapsed(recent=False):
+    """\
+    Self time per stack in the collapsed stack format, in microseconds
+
+    Covers everything since profiling was enabled, or with recent=True only the frames kept in frames.
+    """
+
+    # The render loop takes _lock on every wrapped call, so only copy under it and merge and format outside
+    if recent:
+        with _lock:
+            # Closed frames are never modified again
+            recent_frames = list(frames)
+        merged = {}
+        for frame in recent_frames:
+            for stack, t in frame.items():
+                merged[stack] = merged.get(stack, 0.0) + t
+    else:
+        with _lock:
+            merged = {stack: entry[2] for stack, entry in totals.items()}
+    return ''.join(f"{';'.join(stack)} {int(t * 1e6)}\n" for stack, t in sorted(merged.items()))
+
+
+def write_collapsed(path, recent=False):
+    with open(path, 'w') as fp:
+        fp.write(collapsed(recent=recent))
+
+
+def top(n=20):
+    # The n stacks with the most self time as (stack, calls, total seconds, self seconds)
+    with _lock:
+        items = [(';'.join(stack), *entry) for stack, entry in totals.items()]
+    return sorted(items, key=lambda i: i[3], reverse=True)[:n]
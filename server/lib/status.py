@@ -0,0 +1,134 @@
+"""\
+Local HTTP endpoint for metrics and live state
+
+/metrics serves lib.metrics in the Prometheus text format, /state a JSON snapshot of light output state, the running
+scene, programs and effects and how often each trigger group fired, /profile the collapsed stacks from lib.profile
+(?recent=1 for only the last few frames).  The state is built by the render loop (which
+owns it, so no locks are needed) at most every publish interval and swapped in whole, the HTTP thread only ever reads
+the latest snapshot.
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import re
+import time
+
+from lib import HasThread, metrics, profile
+
+
+def _describe_triggers(obj):
+    return dict(getattr(obj, 'trigger_counts', {}))
+
+
+def describe_program(program):
+    if program.multiple:
+        running = [e.name for e in program.running_effects.values()]
+    else:
+        running = [program.running_effect.name] if program.running_effect is not None else []
+    return {
+        'name': program.name,
+        'running': program.is_running,
+        'effects': running,
+        'triggers': _describe_triggers(program),
+        'effect_triggers': {e.name: _describe_triggers(e) for e in program},
+    }
+
+
+def describe_controller(controller):
+    return {
+        'current_scene': controller.current_scene_idx,
+        'triggers': _describe_triggers(controller),
+        'scenes': [
+            {
+                'name': scene.name,
+                'triggers': _describe_triggers(scene),
+                'programs': [describe_program(p) for p in scene],
+            }
+            for scene in controller
+        ],
+    }
+
+
+class StatusPublisher:
+    """\
+    Holds the latest state snapshot, rebuilt by the render loop
+    """
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.last_publish = None
+        self.snapshot = {'time': None, 'lights': {}, 'controller': None}
+
+    def publish(self, controller, lights, now=None):
+        # Call from the render loop after outputs are updated, does nothing if the last snapshot is recent enough
+        now = time.time() if now is None else now
+        if self.last_publish is not None and now - self.last_publish < self.interval:
+            return
+        self.last_publish = now
+        self.snapshot = {
+            'time': time.time(),
+            # The render loop is the only writer of output_state, copying a dict is atomic
+            'lights': {l.name: dict(l.output_state) for l in lights},
+            'controller': describe_controller(controller),
+        }
+
+
+def _metric_name(name):
+    return 'partylights_' + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def prometheus_text():
+    lines = []
+    for name, n in sorted(metrics.get_counters().items()):
+        name = _metric_name(name) + '_total'
+        lines += [f'# TYPE {name} counter', f'{name} {n}']
+    for name, value in sorted(metrics.get_gauges().items()):
+        if isinstance(value, (int, float)):
+            name = _metric_name(name)
+            lines += [f'# TYPE {name} gauge', f'{name} {value}']
+    for name, h in sorted(metrics.get_histograms().items()):
+        name = _metric_name(name) + '_seconds'
+        lines.append(f'# TYPE {name} summary')
+        for q in (0.5, 0.9, 0.99, 0.999):
+            lines.append(f'{name}{{quantile="{q}"}} {h.percentile(q * 100)}')
+        lines += [f'{name}_sum {h.total / 1e6}', f'{name}_count {h.count}']
+    return '\n'.join(lines) + '\n'
+
+
+class _StatusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        if path == '/metrics':
+            self._send(prometheus_text().encode('utf-8'), 'text/plain; version=0.0.4')
+        elif path == '/state':
+            self._send(json.dumps(self.server.publisher.snapshot, default=str).encode('utf-8'), 'application/json')
+        elif path == '/profile':
+            self._send(profile.collapsed(recent='recent=1' in query).encode('utf-8'), 'text/plain')
+        else:
+            self.send_error(404)
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StatusServer(HasThread):
+    def __init__(self, publisher, host='127.0.0.1', port=8080, *args, **kwargs):
+        self.publisher = publisher
+        self.server = HTTPServer((host, port), _StatusHandler)
+        self.server.publisher = publisher
+        # Wake up periodically so the thread notices when it should stop
+        self.server.timeout = 0.5
+        super().__init__(*args, **kwargs)
+
+    def run_thread_loop(self):
+        self.server.handle_request()
+
+    def teardown_thread(self):
+        self.server.server_close()
@@ -0,0 +1,141 @@
+"""\
+Per-stage timings for recent frames, dumped with their context when a frame goes over budget
+
+The render loop marks the end of each stage of a frame, timings go into preallocated arrays holding the last N frames
+(and into lib.metrics).  Time spent in garbage collection during a frame is recorded too.  When a frame takes longer
+than the budget, that history is written to a JSON file together with whatever the context function returns (e.g.
+the running programs and input values) and a metrics snapshot, from a background thread so writing it doesn't add to
+the stall.
+"""
+
+from array import array
+import gc
+import json
+import os
+import threading
+import time
+
+from lib import metrics
+
+
+class FrameTracer:
+    STAGES = ('input', 'triggers', 'controller', 'outputs')
+
+    def __init__(self, budget=None, size=256, directory='.', min_interval=5.0, context=None):
+        """\
+        Args:
+        budget: Frame time in seconds above which a trace is dumped, None to only keep the history
+        size: Number of frames to keep
+        directory: Where trace files are written
+        min_interval: Minimum seconds between dumps, so a run of slow frames doesn't write a file each
+        context: Function returning a JSON serializable dict added to each dump
+        """
+
+        self.budget = budget
+        self.size = size
+        self.directory = directory
+        self.min_interval = min_interval
+        self.context = context
+        self.stage_index = {name: i for i, name in enumerate(self.STAGES)}
+
+        self.index = array('q', bytes(8 * size))
+        self.time = array('d', bytes(8 * size))
+        self.late = array('d', bytes(8 * size))
+        self.skipped = array('q', bytes(8 * size))
+        self.gc_time = array('d', bytes(8 * size))
+        self.total = array('d', bytes(8 * size))
+        self.stages = array('d', bytes(8 * size * len(self.STAGES)))
+
+        self.count = 0
+        self.slot = 0
+        self.frame_start = None
+        self.last_mark = None
+        self.gc_start = None
+        self.last_dump = None
+        self.dumps = 0
+        gc.callbacks.append(self._gc_callback)
+
+    def _gc_callback(self, phase, info):
+        if phase == 'start':
+            self.gc_start = time.perf_counter()
+        elif self.gc_start is not None:
+            self.gc_time[self.slot] += time.perf_counter() - self.gc_start
+            self.gc_start = None
+
+    def close(self):
+        if self._gc_callback in gc.callbacks:
+            gc.callbacks.remove(self._gc_callback)
+
+    def start(self, frame):
+        slot = self.slot = self.count % self.size
+        self.index[slot] = frame.index
+        self.time[slot] = frame.time
+        self.late[slot] = frame.late
+        self.skipped[slot] = frame.skipped
+        self.gc_time[slot] = 0.0
+        base = slot * len(self.STAGES)
+        for i in range(len(self.STAGES)):
+            self.stages[base + i] = 0.0
+        metrics.observe('frame.late', frame.late)
+        self.frame_start = self.last_mark = time.perf_counter()
+
+    def mark(self, stage):
+        # End of a stage, timed from the previous mark (or the start of the frame)
+        now = time.perf_counter()
+        elapsed = now - self.last_mark
+        self.stages[self.slot * len(self.STAGES) + self.stage_index[stage]] += elapsed
+        self.last_mark = now
+        metrics.observe(stage, elapsed)
+
+    def end(self):
+        now = time.perf_counter()
+        total = self.total[self.slot] = now - self.frame_start
+        self.count += 1
+        metrics.observe('frame', total)
+        if self.budget is not None and total > self.budget:
+            metrics.count('frames.slow')
+            if self.last_dump is None or now - self.last_dump >= self.min_interval:
+                self.last_dump = now
+                self.dump()
+
+    def history(self):
+        # Recorded frames, oldest first
+        out = []
+        for n in range(max(0, self.count - self.size), self.count):
+            slot = n % self.size
+            base = slot * len(self.STAGES)
+            out.append({
+                'index': self.index[slot],
+                'time': self.time[slot],
+                'late': self.late[slot],
+                'skipped': self.skipped[slot],
+                'gc': self.gc_time[slot],
+                'total': self.total[slot],
+                'stages': {name: self.stages[base + i] for i, name in enumerate(self.STAGES)},
+            })
+        return out
+
+    def dump(self):
+        # Capture everything now, in the render loop, and write it out in the background
+        history = self.history()
+        trace = {
+            'wall_time': time.time(),
+            'budget': self.budget,
+            'frame': history[-1] if history else None,
+            'history': history,
+            'metrics': metrics.snapshot(),
+        }
+        if self.context:
+            try:
+                trace.update(self.context())
+            except Exception as e:
+                trace['context_error'] = repr(e)
+        self.dumps += 1
+        path = os.path.join(self.directory, 'slow-frame-{}-{}.json'.format(time.strftime('%Y%m%d-%H%M%S'), trace['frame']['index'] if trace['frame'] else 0))
+        threading.Thread(target=self._write, args=(path, trace), daemon=True).start()
+        return path
+
+    @staticmethod
+    def _write(path, trace):
+        with open(path, 'w') as fp:
+            json.dump(trace, fp, default=str)
@@ -1,33 +1,145 @@
-import time
+import argparse
 import signal
+import threading
 
-from lib import HasThread, fps
+from lib import HasThread, easing
+from lib.frame import FrameScheduler
+
+
+parser = argparse.ArgumentParser(description='Partylights server')
+parser.add_argument('--fps', type=float, default=70.0, help='Target frame rate (default: 70, matching the DMX output rate)')
+parser.add_argument('--late-policy', choices=(FrameScheduler.SKIP, FrameScheduler.CATCHUP), default=FrameScheduler.SKIP, help='What to do with frames that start a full period late (default: skip)')
+parser.add_argument('--easing-resolution', type=int, default=easing.DEFAULT_RESOLUTION, help='Number of samples in each easing lookup table (default: %(default)s)')
+parser.add_argument('--osc-input', choices=('blocking', 'batched'), default='blocking', help='OSC receiver: pythonosc server (blocking) or batched non-blocking UDP (default: blocking)')
+parser.add_argument('--record', metavar='FILE', help='Record all input events to this file (appended to if it exists)')
+parser.add_argument('--replay', metavar='FILE', help='Replay input events from a recording instead of listening for OSC')
+parser.add_argument('--replay-speed', type=float, default=1.0, help='Replay speed multiplier, 0 for as fast as possible (default: 1)')
+parser.add_argument('--status-port', type=int, help='Serve metrics (/metrics) and live state (/state) over HTTP on this port')
+parser.add_argument('--status-host', default='127.0.0.1', help='Address for the status endpoint to listen on (default: %(default)s)')
+parser.add_argument('--profile', action='store_true', help='Profile the controller, scenes, programs, effects and light updates')
+parser.add_argument('--profile-output', metavar='FILE', default='profile.folded', help='Where to write collapsed profile stacks on SIGUSR1 and at exit (default: %(default)s)')
+parser.add_argument('--slow-frame-ms', type=float, help='Dump a trace of recent frames and the current state when a frame takes longer than this')
+parser.add_argument('--slow-frame-dir', default='.', help='Where slow frame traces are written (default: current directory)')
+parser.add_argument('--runtime', choices=('threads', 'asyncio'), default='threads', help='Run inputs, the frame loop and outputs in their own threads, or on one asyncio event loop (default: threads)')
+args = parser.parse_args()
+
+easing.set_resolution(args.easing_resolution)
+
+# With asyncio, the event loop drives every component - this must be set before any of them (including the config's
+# outputs and the metrics reporter) are created
+HasThread.autostart = args.runtime == 'threads'
+
+from lib import metrics, profile
 from lib.inputs import Input
 from lib.inputs.osc import OSCServerInput
 from lib.inputs.osc.flavors import SynesthesiaOSCFlavor
+from lib.inputs.osc.udp import BatchedOSCInput
+from lib.inputs.recording import Recorder, ReplayInput
 from lib.lights import Light
 from lib.outputs import Output
+from lib.status import StatusPublisher, StatusServer, describe_controller
+from lib.tracer import FrameTracer
 
 from tempconfig import controller
 
 
-do_terminate = False
-def signal_handler(signo, frame):
-    global do_terminate
-    do_terminate = True
+data_version = None
+def run_frame(frame):
+    global data_version
+    tracer.start(frame)
+    if frame.skipped:
+        metrics.count('frames.skipped', frame.skipped)
+    lights = Light.get(aslist=True)
+    data = Input.get_data(timeout=scheduler.period / 2)
+    tracer.mark('input')
+    controller.run_triggers(data, frame=frame, changed=Input.changed_since(data_version))
+    data_version = data.version
+    tracer.mark('triggers')
+    output = controller(data, lights, frame=frame)
+    tracer.mark('controller')
+    Output.run_all(output, lights)
+    if status:
+        status.publish(controller, lights, frame.time)
+    tracer.mark('outputs')
+    tracer.end()
+    profile.end_frame()
+    if profile_dump.is_set():
+        profile_dump.clear()
+        profile.write_collapsed(args.profile_output)
+    metrics.count('frames')
+
+
+def trace_context():
+    return {
+        'controller': describe_controller(controller),
+        'input': dict(Input.snapshot.items()),
+    }
+
+
+flavor = SynesthesiaOSCFlavor()
+scheduler = FrameScheduler(fps=args.fps, late_policy=args.late_policy)
+
+tracer = FrameTracer(
+    budget=args.slow_frame_ms / 1000 if args.slow_frame_ms else None,
+    directory=args.slow_frame_dir,
+    context=trace_context,
+)
+
+recorder = None
+if args.record:
+    recorder = Recorder(args.record)
+    recorder.start()
+
+# Set by SIGUSR1, the dump is written by the frame loop - the signal handler can interrupt the frame loop while it
+# holds the profiler's lock
+profile_dump = threading.Event()
+if args.profile:
+    profile.enable()
+    signal.signal(signal.SIGUSR1, lambda signo, frame: profile_dump.set())
+
+status = None
+if args.status_port:
+    status = StatusPublisher()
+    # Runs in its own thread with either runtime
+    StatusServer(status, host=args.status_host, port=args.status_port, start_immediately=True)
+
+replay = None
+if args.replay:
+    # Replay always runs in its own thread
+    replay = ReplayInput(args.replay, speed=args.replay_speed or None, start_immediately=True)
+
+if args.runtime == 'asyncio':
+    from lib.aio import AsyncRuntime
+
+    try:
+        AsyncRuntime(run_frame, scheduler, osc_flavor=None if replay else flavor).run(signals=(signal.SIGINT, signal.SIGTERM))
+    finally:
+        HasThread.stop_all()
+        if recorder:
+            recorder.stop()
+        if args.profile:
+            profile.write_collapsed(args.profile_output)
+else:
+    do_terminate = False
+    def signal_handler(signo, frame):
+        global do_terminate
+        do_terminate = True
 
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
 
-try:
-    flavor = SynesthesiaOSCFlavor()
-    server = OSCServerInput(flavor)
+    try:
+        if not replay:
+            if args.osc_input == 'batched':
+                server = BatchedOSCInput(flavor)
+            else:
+                server = OSCServerInput(flavor)
 
-    while not do_terminate:
-        lights = Light.get(aslist=True)
-        data = Input.get_data(timeout=0.01)
-        controller.run_triggers(data)
-        Output.run_all(controller(data, lights), lights)
-        fps.count('main')
-finally:
-    HasThread.stop_all()
+        while not do_terminate:
+            run_frame(scheduler.wait())
+    finally:
+        HasThread.stop_all()
+        if recorder:
+            recorder.stop()
+        if args.profile:
+            profile.write_collapsed(args.profile_output)
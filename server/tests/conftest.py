@@ -0,0 +1,8 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing lib modules would otherwise start their background threads (e.g. the metrics reporter)
+from lib import HasThread
+HasThread.autostart = False
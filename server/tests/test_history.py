@@ -0,0 +1,41 @@
+import random
+
+from lib.inputs.history import EventHistory
+
+
+def test_window_slides_with_now():
+    h = EventHistory(16)
+    for t, v in enumerate([1.0, 5.0, 2.0]):
+        h.push(float(t), v)
+    assert h.max(1.5) == 5.0
+    assert h.max(1.5, now=2.6) == 2.0
+    assert h.mean(1.5, now=2.6) == 2.0
+    # No samples left in the window once the event stops updating
+    assert h.max(1.5, now=10.0) is None
+    assert h.min(1.5, now=10.0) is None
+    assert h.mean(1.5, now=10.0) is None
+    # The whole buffer doesn't expire
+    assert h.max() == 5.0
+    assert h.min() == 1.0
+
+
+def test_matches_scan():
+    rng = random.Random(1)
+    h = EventHistory(32)
+    samples = []
+    now = 0.0
+    for _ in range(500):
+        # Frame times only move forward, samples arrive between them
+        t = now + rng.random() * 0.05
+        now = t + rng.random() * 0.2
+        v = rng.random()
+        h.push(t, v)
+        samples = (samples + [(t, v)])[-32:]
+        for seconds in (None, 0.25, 1.0):
+            window = [v for st, v in samples if seconds is None or st >= now - seconds]
+            assert h.min(seconds, now) == (min(window) if window else None)
+            assert h.max(seconds, now) == (max(window) if window else None)
+            mean = h.mean(seconds, now)
+            assert (mean is None) == (not window)
+            if window:
+                assert abs(mean - sum(window) / len(window)) < 1e-9
@@ -0,0 +1,65 @@
+import struct
+
+from lib.inputs.osc.flavors import SynesthesiaOSCFlavor
+from lib.inputs.osc.udp import MAX_BUNDLE_DEPTH, OSCDecoder
+
+
+def osc_string(s):
+    s = s.encode('utf-8') + b'\0'
+    return s + b'\0' * (-len(s) % 4)
+
+
+def message(address, value):
+    return osc_string(address) + osc_string(',f') + struct.pack('>f', value)
+
+
+def bundle(*elements):
+    return b'#bundle\0' + bytes(8) + b''.join(struct.pack('>i', len(e)) + e for e in elements)
+
+
+def decoder():
+    return OSCDecoder(SynesthesiaOSCFlavor())
+
+
+def test_message():
+    assert decoder().decode(message('/audio/bpm/bpm', 120.0)) == [('/audio/bpm/bpm', (120.0,))]
+
+
+def test_bundle():
+    data = bundle(message('/audio/bpm/bpm', 120.0), bundle(message('/audio/beat/onbeat', 1.0)))
+    assert decoder().decode(data) == [('/audio/bpm/bpm', (120.0,)), ('/audio/beat/onbeat', (1.0,))]
+
+
+def test_negative_size():
+    assert decoder().decode(b'#bundle\0' + bytes(8) + struct.pack('>i', -4) + b'xxxx') == []
+
+
+def test_negative_size_nested():
+    inner = b'#bundle\0' + bytes(8) + struct.pack('>i', -4) + b'xxxx'
+    data = bundle(message('/audio/bpm/bpm', 120.0), inner, message('/audio/beat/onbeat', 1.0))
+    assert decoder().decode(data) == [('/audio/bpm/bpm', (120.0,)), ('/audio/beat/onbeat', (1.0,))]
+
+
+def test_truncated():
+    data = bundle(message('/audio/bpm/bpm', 120.0), message('/audio/beat/onbeat', 1.0))
+    # Messages before the truncated element are kept
+    assert decoder().decode(data[:-4]) == [('/audio/bpm/bpm', (120.0,))]
+    assert decoder().decode(data[:18]) == []
+    assert decoder().decode(message('/audio/bpm/bpm', 120.0)[:-2]) == []
+
+
+def test_malformed():
+    assert decoder().decode(b'') == []
+    assert decoder().decode(b'/no/terminator') == []
+    assert decoder().decode(osc_string('/x') + osc_string(',q')) == []
+    assert decoder().decode(bundle(b'garbage')) == []
+
+
+def test_deep_nesting():
+    data = message('/audio/bpm/bpm', 120.0)
+    for _ in range(MAX_BUNDLE_DEPTH):
+        data = bundle(data)
+    assert decoder().decode(data) == [('/audio/bpm/bpm', (120.0,))]
+    for _ in range(2000):
+        data = bundle(data)
+    assert decoder().decode(data) == []